@@ -2,8 +2,10 @@ import streamlit as st
 import pandas as pd
 import time
 from datetime import date
-from db import get_supabase
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from db import get_supabase, get_user_credentials, upsert_instance_types, get_instance_type_catalog
 from billing import process_daily_billing
+from logic import fetch_instance_types, guess_type_category, get_enabled_regions, set_instance_type_catalog
 
 def is_admin():
     """Check if current user is admin."""
@@ -130,6 +132,42 @@ def admin_dashboard():
             
             st.success(f"已处理 {count} 个用户的账单。")
 
+        st.divider()
+        st.subheader("🧮 机型目录同步")
+        st.caption("调用 describe_instance_types 获取各区域机型的 vCPU / 内存 / 架构并写入 aws_instance_types。")
+
+        admin_creds = [c for c in get_user_credentials(st.session_state.get("user_id")) if c.get('status') != 'suspended']
+        if not admin_creds:
+            st.info("需要至少一个可用的 AWS 凭证才能同步机型目录。")
+        else:
+            sync_cred = admin_creds[0]
+            all_regions = get_enabled_regions(sync_cred['access_key_id'], sync_cred['secret_access_key'], proxy_url=sync_cred.get('proxy_url'))
+            sync_regions = st.multiselect("同步区域", all_regions, default=[r for r in ['us-east-1'] if r in all_regions])
+
+            if st.button("🔄 同步机型目录") and sync_regions:
+                merged = {}
+                errors = []
+                with st.spinner("正在拉取机型信息..."):
+                    with ThreadPoolExecutor(max_workers=8) as executor:
+                        futures = {
+                            executor.submit(fetch_instance_types, sync_cred['access_key_id'], sync_cred['secret_access_key'], r, sync_cred.get('proxy_url')): r
+                            for r in sync_regions
+                        }
+                        for future in as_completed(futures):
+                            try:
+                                for row in future.result():
+                                    row['category'] = guess_type_category(row['instance_type'])
+                                    merged[row['instance_type']] = row
+                            except Exception as e:
+                                errors.append(f"{futures[future]}: {e}")
+
+                    written = upsert_instance_types(list(merged.values()))
+                    set_instance_type_catalog(get_instance_type_catalog())
+
+                st.success(f"同步完成：{written} 个机型。")
+                for err in errors:
+                    st.warning(err)
+
     # Return button
     if st.sidebar.button("⬅️ 返回前台"):
         st.session_state['admin_mode'] = False
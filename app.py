@@ -5,11 +5,19 @@ import os
 import pandas as pd
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from logic import launch_base_instance, AMI_MAPPING, get_instance_status, terminate_instance, scan_all_instances, check_account_health, check_capacity, get_vcpu_quota, has_running_instances
+from logic import launch_base_instances, launch_fleet, fleet_type_weights, FLEET_MAX_WEIGHT, AMI_MAPPING, get_fleet_status, terminate_instances, iter_instances, plan_region_scan, account_slot, get_enabled_regions, set_instance_type_catalog, check_capacity
 from templates import PROJECT_REGISTRY, generate_script
-from db import log_instance, get_user_instances, update_instance_status, add_aws_credential, get_user_credentials, delete_aws_credential, sync_instances, update_credential_status, get_instance_private_key, update_instance_health, update_instance_projects_status, update_aws_credential, get_all_instance_types, get_credential_vcpu_usage, delete_instance
+from db import get_supabase, log_instances, get_user_instances, update_instance_status, add_aws_credential, get_user_credentials, delete_aws_credential, sync_instances, get_instance_private_key, resolve_instance_key, update_instance_health, update_instance_projects_status, update_aws_credential, get_instance_type_catalog, delete_instances
 from auth import login_page, init_authenticator, ensure_session_state
-from monitor import check_instance_process, install_project_via_ssh, detect_installed_project
+from monitor import check_instance_process, install_project_via_ssh, inspect_instance, preload_private_keys, start_install_job, get_ssh_pool_stats
+from async_monitor import HAS_ASYNCSSH, batch_inspect
+from aws_pool import get_pool_stats, get_throttle_stats, invalidate_credential
+from launch_tracker import tracker as launch_tracker
+from install_tracker import tracker as install_tracker
+from spot_advisor import rank_placements, mark_capacity_exhausted, is_capacity_error, SPOT_MAX_PLACEMENTS
+from health import check_credential, forget_credential
+from reachability import sweep_instances
+from key_registry import ensure_key_pair, repair_key_pair, is_missing_key_error, registry as key_registry
 
 # Import Admin Dashboard
 from admin import admin_dashboard
@@ -86,6 +94,10 @@ def main():
     # Pre-fetch credentials for global use in all tabs
     creds = get_user_credentials(user_id)
     cred_lookup = {c['id']: c for c in creds} if creds else {}
+    
+    # Instance type catalog: loaded once per process, shared with logic.py
+    type_catalog = get_instance_type_catalog()
+    set_instance_type_catalog(type_catalog)
 
     # ====================
     # TAB 1: Credentials Management
@@ -148,43 +160,17 @@ def main():
                         
                         def check_worker(cred):
                             try:
-                                # Basic Health Check
-                                proxy_url = cred.get('proxy_url')
-                                res = check_account_health(cred['access_key_id'], cred['secret_access_key'], proxy_url=proxy_url)
-                                
-                                # Quota Check if active
-                                limit = None
-                                used = None
+                                # Cached per credential: repeated clicks cost no API calls
+                                report = check_credential(cred, default_region)
                                 quota_msg = ""
+                                if report['status'] == 'active':
+                                    used_display = "未知" if report['used'] == -1 else str(report['used'])
+                                    quota_msg = f" | 配额: {used_display}/{report['limit']}"
+                                if report['cached']:
+                                    quota_msg += " (缓存)"
                                 
-                                if res['status'] == 'active':
-                                    # 1. Get Limit (API)
-                                    limit = get_vcpu_quota(cred['access_key_id'], cred['secret_access_key'], default_region, proxy_url=proxy_url)
-                                    
-                                    # 2. Get Usage (DB First)
-                                    db_used = get_credential_vcpu_usage(cred['id'])
-                                    used_display = "0"
-                                    
-                                    if db_used > 0:
-                                        used = db_used
-                                        used_display = str(used)
-                                    else:
-                                        # DB says 0, double check AWS lightly
-                                        has_running = has_running_instances(cred['access_key_id'], cred['secret_access_key'], default_region, proxy_url=proxy_url)
-                                        if has_running:
-                                            used = -1 # Indicate Unknown in DB
-                                            used_display = "未知"
-                                        else:
-                                            used = 0
-                                            used_display = "0"
-
-                                    quota_msg = f" | 配额: {used_display}/{limit}"
-                                
-                                # Update DB
-                                update_credential_status(cred['id'], res['status'], limit=limit, used=used)
-                                
-                                icon = "✅" if res['status'] == 'active' else "⚠️"
-                                return f"{icon} {cred['alias_name']}: {res['msg']}{quota_msg}"
+                                icon = "✅" if report['status'] == 'active' else "⚠️"
+                                return f"{icon} {cred['alias_name']}: {report['msg']}{quota_msg}"
                             except Exception as e:
                                 return f"❌ {cred['alias_name']}: 检查失败 - {str(e)}"
 
@@ -269,23 +255,9 @@ def main():
                     # Single Check Button
                     if st.button("🩺", key=f"check_{cred['id']}", help="检查此账号健康与配额"):
                         with st.spinner("检查中..."):
-                            # Reuse check logic (inline for single)
+                            # Explicit single check bypasses every cache
                             try:
-                                proxy_url = cred.get('proxy_url')
-                                res = check_account_health(cred['access_key_id'], cred['secret_access_key'], proxy_url=proxy_url)
-                                
-                                limit = None
-                                used = None
-                                if res['status'] == 'active':
-                                    limit = get_vcpu_quota(cred['access_key_id'], cred['secret_access_key'], default_region, proxy_url=proxy_url)
-                                    db_used = get_credential_vcpu_usage(cred['id'])
-                                    if db_used > 0:
-                                        used = db_used
-                                    else:
-                                        has_running = has_running_instances(cred['access_key_id'], cred['secret_access_key'], default_region, proxy_url=proxy_url)
-                                        used = -1 if has_running else 0
-                                
-                                update_credential_status(cred['id'], res['status'], limit=limit, used=used)
+                                check_credential(cred, default_region, force=True)
                                 st.success("检查完成")
                                 time.sleep(0.5)
                                 st.rerun()
@@ -298,6 +270,9 @@ def main():
                     # Delete Button
                     if st.button("🗑️", key=f"del_{cred['id']}", help="删除此凭证"):
                         delete_aws_credential(cred['id'])
+                        invalidate_credential(cred['access_key_id'])
+                        key_registry.forget(cred['id'])
+                        forget_credential(cred)
                         st.rerun()
             
             # Render Edit Form if active
@@ -317,6 +292,9 @@ def main():
                                     # Pass full info for upsert
                                     success, msg = update_aws_credential(cred['id'], user_id, new_alias, new_ak, new_sk, new_proxy, cred.get('status', 'active'))
                                     if success:
+                                        invalidate_credential(cred['access_key_id'])
+                                        key_registry.forget(cred['id'])
+                                        forget_credential(cred)
                                         st.success("更新成功！")
                                         st.session_state[f"edit_mode_{cred['id']}"] = False
                                         time.sleep(0.5)
@@ -340,8 +318,12 @@ def main():
             st.warning("请先在“凭证管理”页面添加 AWS 凭证。")
         else:
             st.sidebar.header("部署配置")
-            # Region selection
-            region_options = list(AMI_MAPPING.keys())
+            # Region selection: any region enabled for the accounts (AMIs resolved via SSM)
+            region_cred = next((c for c in creds if c.get('status') != 'suspended'), None)
+            if region_cred:
+                region_options = get_enabled_regions(region_cred['access_key_id'], region_cred['secret_access_key'], proxy_url=region_cred.get('proxy_url'))
+            else:
+                region_options = list(AMI_MAPPING.keys())
             try:
                 r_index = region_options.index(default_region)
             except ValueError:
@@ -358,8 +340,8 @@ def main():
             # Row 1: Instance Type Selection
             col_fam, col_type = st.columns([1, 2])
             
-            # Load Instance Types from DB
-            db_instance_types = get_all_instance_types()
+            # Load Instance Types (process-wide catalog)
+            db_instance_types = list(type_catalog.values())
             
             # Organize by Category
             categories = {}
@@ -387,7 +369,12 @@ def main():
                 spec_info = {}
                 if family_filter == "自定义输入":
                     target_instance_type = st.text_input("请输入 AWS 机型代码 (例如: c6a.2xlarge)", value="t2.micro").strip()
-                    spec_info = {"vcpu_count": 0, "memory_gb": 0} # Unknown
+                    custom_spec = type_catalog.get(target_instance_type)
+                    if custom_spec:
+                        spec_info = {"vcpu_count": custom_spec.get('vcpu'), "memory_gb": custom_spec.get('memory_gb'), "arch": custom_spec.get('arch')}
+                        st.caption(f"{custom_spec.get('vcpu')} vCPU, {custom_spec.get('memory_gb')} GB, {custom_spec.get('arch')}")
+                    else:
+                        spec_info = {"vcpu_count": 0, "memory_gb": 0} # Unknown (not in catalog)
                 else:
                     available_types = categories.get(family_filter, [])
                     
@@ -404,7 +391,8 @@ def main():
                     raw_spec = type_to_spec.get(target_instance_type, {})
                     spec_info = {
                         "vcpu_count": raw_spec.get('vcpu'),
-                        "memory_gb": raw_spec.get('memory_gb')
+                        "memory_gb": raw_spec.get('memory_gb'),
+                        "arch": raw_spec.get('arch')
                     }
 
             # Row 2: OS & Storage
@@ -412,7 +400,12 @@ def main():
             
             with col_os:
                 os_type = st.selectbox("操作系统", ["Amazon Linux 2023", "Ubuntu 22.04 LTS", "Ubuntu 24.04 LTS"], index=0)
-                image_type_code = 'al2023' if "Amazon" in os_type else 'ubuntu'
+                if "Amazon" in os_type:
+                    image_type_code = 'al2023'
+                elif "24.04" in os_type:
+                    image_type_code = 'ubuntu24'
+                else:
+                    image_type_code = 'ubuntu22'
                 
             with col_vol_size:
                 volume_size = st.number_input("根卷大小 (GB)", min_value=8, max_value=1000, value=30, step=1)
@@ -423,8 +416,40 @@ def main():
             st.caption(f"已选配置: **{target_instance_type}** | **{os_type}** | **{volume_size}GB {volume_type}**")
             
             # Spot Option
-            use_spot = st.checkbox("启用 Spot 实例 (Spot Mode)", help="使用竞价实例以降低成本，但可能会被中断")
+            col_spot, col_count = st.columns([2, 1])
+            with col_spot:
+                use_spot = st.checkbox("启用 Spot 实例 (Spot Mode)", help="使用竞价实例以降低成本，但可能会被中断")
+                spot_auto_region = False
+                if use_spot:
+                    spot_auto_region = st.checkbox("自动选择最便宜的区域", help="按 Spot 价格在所有已启用区域中选择；关闭时只在当前区域内选择最便宜的可用区")
+            with col_count:
+                launch_count = st.number_input("每账号实例数", min_value=1, max_value=100, value=1, step=1, help="同一账号的多台实例通过单次 run_instances 批量创建")
+
+            # EC2 Fleet: one create_fleet call spread over comparable types of the category and all AZs
+            fleet_mode = False
+            fleet_types = {}
+            if family_filter != "自定义输入":
+                # Types with at least the selected vCPU/memory, weighted by vCPU relative to it
+                fleet_candidates = fleet_type_weights(target_instance_type, categories.get(family_filter, []))
+                fleet_mode = st.checkbox(
+                    f"Fleet 多机型模式 ({family_filter}: {len(fleet_candidates)} 个可替代机型)",
+                    help=f"使用 EC2 Fleet (instant) 一次调用在不低于所选规格 (vCPU/内存) 的同架构机型与所有可用区中申请实例；按 vCPU 计权 (最多 {FLEET_MAX_WEIGHT} 倍)，实例数按所选机型折算，减少容量不足导致的失败"
+                )
+                if fleet_mode:
+                    fleet_types = fleet_candidates
             
+            if use_spot and region_cred and not fleet_mode:
+                with st.expander("💡 Spot 价格建议"):
+                    if st.button("查询 Spot 价格排行"):
+                        with st.spinner("正在拉取 Spot 价格历史..."):
+                            spot_regions = region_options if spot_auto_region else [region]
+                            ranked = rank_placements(region_cred['access_key_id'], region_cred['secret_access_key'], spot_regions, [target_instance_type], proxy_url=region_cred.get('proxy_url'))
+                        if ranked:
+                            st.dataframe(pd.DataFrame(ranked[:20]), use_container_width=True, hide_index=True)
+                            st.caption("价格单位: USD/小时 (Linux/UNIX)。可用区名称按账号映射，以上为第一个可用账号的视图。")
+                        else:
+                            st.info("暂无该机型的 Spot 价格数据")
+
             # 2.1 Batch Launch Selection
             st.write("选择要部署的 AWS 账号 (可多选):")
             
@@ -451,41 +476,109 @@ def main():
                     status_area = st.empty()
                     results = []
                     
+                    # Launches return immediately; the tracker fills in IP/status
+                    launch_job_id = launch_tracker.new_job()
+                    st.session_state["launch_job"] = launch_job_id
+                    tracker_db_client = get_supabase()
+                    
                     def launch_worker(cred):
-                        # Quota Check
-                        try:
-                            proxy_url = cred.get('proxy_url')
-                            cap = check_capacity(cred['access_key_id'], cred['secret_access_key'], region, proxy_url=proxy_url)
-                            if cap['available'] < 1:
-                                return f"⚠️ {cred['alias_name']}: 跳过 - 配额不足 (已用 {cap['used']}/{cap['limit']})"
-                        except Exception as e:
-                            pass # Try launch anyway as per original logic
+                        proxy_url = cred.get('proxy_url')
+                        # Candidate placements: (region, AZ). Spot launches walk the
+                        # advisor's ranking (cheapest first) until one has capacity.
+                        placements = [(region, None)]
+                        if use_spot and not fleet_mode:
+                            try:
+                                spot_regions = region_options if spot_auto_region else [region]
+                                ranked = rank_placements(cred['access_key_id'], cred['secret_access_key'], spot_regions, [target_instance_type], proxy_url=proxy_url)
+                                if ranked:
+                                    placements = [(c['region'], c['az']) for c in ranked[:SPOT_MAX_PLACEMENTS]]
+                            except Exception as e:
+                                print(f"Spot advisor failed: {e}")
 
                         try:
-                            proxy_url = cred.get('proxy_url')
-                            result = launch_base_instance(
-                                cred['access_key_id'],
-                                cred['secret_access_key'],
-                                region,
-                                instance_type=target_instance_type,
-                                image_type=image_type_code,
-                                volume_size=volume_size,
-                                volume_type=volume_type,
-                                proxy_url=proxy_url,
-                                use_spot=use_spot
-                            )
+                            result = None
+                            skipped = []
+                            for launch_region, launch_az in placements:
+                                count = int(launch_count)
+                                # Quota Check (served from the per-account capacity cache)
+                                try:
+                                    cap = check_capacity(cred['access_key_id'], cred['secret_access_key'], launch_region, proxy_url=proxy_url)
+                                    if cap['available'] < 1:
+                                        skipped.append(f"{launch_region} 配额不足 (已用 {cap['used']}/{cap['limit']})")
+                                        continue
+                                    per_instance = spec_info.get('vcpu_count') or 1
+                                    count = max(1, min(count, cap['available'] // per_instance))
+                                except Exception as e:
+                                    pass # Try launch anyway as per original logic
+
+                                # Shared key pair of this account/region (imported once)
+                                key_pair = ensure_key_pair(user_id, cred, launch_region)
+
+                                def run_launch(key_name):
+                                    if fleet_mode:
+                                        return launch_fleet(
+                                            cred['access_key_id'],
+                                            cred['secret_access_key'],
+                                            launch_region,
+                                            fleet_types,
+                                            count=count,
+                                            key_name=key_name,
+                                            image_type=image_type_code,
+                                            volume_size=volume_size,
+                                            volume_type=volume_type,
+                                            proxy_url=proxy_url,
+                                            use_spot=use_spot,
+                                            arch=spec_info.get('arch') or 'x86_64'
+                                        )
+                                    return launch_base_instances(
+                                        cred['access_key_id'],
+                                        cred['secret_access_key'],
+                                        launch_region,
+                                        count=count,
+                                        instance_type=target_instance_type,
+                                        image_type=image_type_code,
+                                        volume_size=volume_size,
+                                        volume_type=volume_type,
+                                        proxy_url=proxy_url,
+                                        use_spot=use_spot,
+                                        wait=False,
+                                        arch=spec_info.get('arch') or 'x86_64',
+                                        key_name=key_name,
+                                        availability_zone=launch_az
+                                    )
+
+                                result = run_launch(key_pair['key_name'])
+                                if result['status'] == 'error' and is_missing_key_error(result.get('msg')):
+                                    # Key deleted in the AWS console: re-import and retry once
+                                    key_pair = repair_key_pair(user_id, cred, launch_region)
+                                    result = run_launch(key_pair['key_name'])
+
+                                if launch_az and result['status'] == 'error' and is_capacity_error(result.get('msg')):
+                                    # No spot capacity here: cool this AZ down and try the next one
+                                    mark_capacity_exhausted(cred['access_key_id'], launch_region, launch_az, target_instance_type)
+                                    skipped.append(f"{launch_az} 无容量")
+                                    continue
+                                break
+
+                            if result is None:
+                                return f"⚠️ {cred['alias_name']}: 跳过 - {'; '.join(skipped)}"
                             
-                            if result['status'] == 'success':
+                            if result['status'] != 'error':
+                                launched_ids = [inst['id'] for inst in result['instances']]
+                                if fleet_mode:
+                                    # Fleet mixes types: log each instance with its own specs
+                                    for inst in result['instances']:
+                                        t_spec = type_catalog.get(inst['instance_type']) or {}
+                                        inst['specs'] = {"instance_type": inst['instance_type'], "vcpu_count": t_spec.get('vcpu'), "memory_gb": t_spec.get('memory_gb')}
                                 try:
-                                    log_instance(
+                                    log_instances(
                                         user_id=user_id,
                                         credential_id=cred['id'],
-                                        instance_id=result['id'],
-                                        ip=result['ip'],
-                                        region=region,
+                                        region=launch_region,
+                                        instances=result['instances'],
                                         project_name="Pending",
-                                        status="active",
-                                        private_key=result.get('private_key'),
+                                        status="pending",
+                                        key_pair_id=key_pair['id'],
                                         specs={
                                             "instance_type": target_instance_type,
                                             "vcpu_count": spec_info.get('vcpu_count'),
@@ -494,22 +587,36 @@ def main():
                                             "disk_info": f"{volume_size}GB {volume_type}"
                                         }
                                     )
-                                    return f"✅ {cred['alias_name']}: 成功 ({result['id']})"
+                                    launch_tracker.track(
+                                        launch_job_id,
+                                        cred['access_key_id'],
+                                        cred['secret_access_key'],
+                                        launch_region,
+                                        launched_ids,
+                                        proxy_url=proxy_url,
+                                        db_client=tracker_db_client
+                                    )
+                                    if result['status'] == 'partial':
+                                        return f"⚠️ {cred['alias_name']}: 部分成功 {result['launched']}/{int(launch_count)} - {result['msg']}"
+                                    placement = f"{launch_region}/{launch_az}" if launch_az else launch_region
+                                    return f"✅ {cred['alias_name']}: 成功 {result['launched']} 台 @ {placement} ({', '.join(launched_ids)})"
                                 except Exception as db_err:
-                                    # Launch success but DB log failed -> ROLLBACK (Terminate Instance)
+                                    # Launch success but DB log failed -> ROLLBACK (Terminate Instances)
                                     print(f"DB Log Error: {db_err}")
-                                    try:
-                                        # Attempt to terminate the zombie instance
-                                        terminate_instance(
-                                            cred['access_key_id'], 
-                                            cred['secret_access_key'], 
-                                            region, 
-                                            result['id'], 
-                                            proxy_url=proxy_url
-                                        )
+                                    # Terminate the zombie instances in one batched call
+                                    term_results = terminate_instances(
+                                        cred['access_key_id'],
+                                        cred['secret_access_key'],
+                                        launch_region,
+                                        launched_ids,
+                                        proxy_url=proxy_url
+                                    )
+                                    # not_found on a fresh ID may just be eventual consistency: report it too
+                                    failed_rollback = [i_id for i_id in launched_ids if term_results.get(i_id, {}).get('status') != 'success']
+                                    if failed_rollback:
+                                        rollback_msg = f"实例销毁失败 ({', '.join(failed_rollback)})，请手动处理！"
+                                    else:
                                         rollback_msg = "实例已自动销毁"
-                                    except Exception as term_err:
-                                        rollback_msg = f"实例销毁失败 ({str(term_err)})，请手动处理！"
                                         
                                     return f"❌ {cred['alias_name']}: 数据库记录失败，{rollback_msg} - {str(db_err)}"
                             else:
@@ -552,6 +659,25 @@ def main():
                         for r in results:
                             st.write(r)
 
+            # 2.2 Background launch progress (survives reruns)
+            if st.session_state.get("launch_job"):
+                job_progress = launch_tracker.progress(st.session_state["launch_job"])
+                if job_progress and job_progress['total']:
+                    st.write("实例启动进度 (后台跟踪):")
+                    settled = job_progress['total'] - job_progress['pending']
+                    st.progress(settled / job_progress['total'])
+                    st.caption(f"运行中 {job_progress['running']} | 等待中 {job_progress['pending']} | 失败/超时 {job_progress['failed']} (共 {job_progress['total']})")
+                    if job_progress['done']:
+                        if job_progress['failed']:
+                            st.warning(f"启动结束：{job_progress['failed']} 台实例失败/超时，{job_progress['running']} 台已就绪，状态已写入数据库。")
+                        else:
+                            st.success("所有实例已就绪，IP 已写入数据库。")
+                        if "display_data" in st.session_state:
+                            del st.session_state["display_data"]
+                        del st.session_state["launch_job"]
+                    elif st.button("🔄 刷新启动进度"):
+                        st.rerun()
+
     # ====================
     # TAB 3: Manage Instances
     # ====================
@@ -580,27 +706,30 @@ def main():
                         progress_bar = st.progress(0)
                         status_text = st.empty()
                         
+                        # Decrypt every key once per refresh (local decryption saves DB calls);
+                        # hosts sharing a registered key pair share one entry
+                        instance_keys = {}
+                        for inst in targets:
+                            try:
+                                instance_keys[inst['instance_id']] = resolve_instance_key(inst)
+                            except Exception:
+                                instance_keys[inst['instance_id']] = False
+                        
                         # Function to process single instance
                         def process_instance(inst):
                             try:
-                                # Use local decryption to save DB call
-                                pkey_str = None
-                                if inst.get('private_key'):
-                                    try:
-                                        pkey_str = decrypt_key(inst['private_key'])
-                                    except:
-                                        return (inst['ip_address'], "Key Decrypt Fail")
+                                pkey_str = instance_keys.get(inst['instance_id'])
+                                if pkey_str is False:
+                                    update_instance_health(inst['instance_id'], "Error: Key Decrypt Fail")
+                                    return (inst['ip_address'], "Key Decrypt Fail")
                                 
                                 if pkey_str:
-                                    # 1. Auto-detect project
-                                    detected_projs, det_msg = detect_installed_project(inst['ip_address'], pkey_str)
+                                    # 1. Auto-detect project + 2. Check health (one probe round trip)
+                                    detected_projs, is_healthy, msg = inspect_instance(inst['ip_address'], pkey_str, inst.get('project_name') or "")
                                     
                                     if detected_projs:
                                         update_instance_projects_status(inst['instance_id'], detected_projs)
                                     
-                                    # 2. Check health
-                                    check_str = ", ".join(detected_projs) if detected_projs else (inst.get('project_name') or "")
-                                    is_healthy, msg = check_instance_process(inst['ip_address'], pkey_str, check_str)
                                     new_health = "Healthy" if is_healthy else f"Error: {msg}"
                                     update_instance_health(inst['instance_id'], new_health)
                                     return (inst['ip_address'], "Done")
@@ -610,29 +739,79 @@ def main():
                             except Exception as e:
                                 return (inst['ip_address'], f"Ex: {str(e)}")
 
-                        # Use ThreadPoolExecutor for parallel execution
                         total = len(targets)
                         completed = 0
                         
-                        with ThreadPoolExecutor(max_workers=10) as executor:
-                            future_to_ip = {executor.submit(process_instance, inst): inst['ip_address'] for inst in targets}
+                        if HAS_ASYNCSSH:
+                            # Async engine: every host on one event loop, then DB writes
+                            hosts = [
+                                {"ip": inst['ip_address'], "private_key": instance_keys.get(inst['instance_id']) or None, "project_name": inst.get('project_name') or ""}
+                                for inst in targets
+                            ]
                             
-                            for future in as_completed(future_to_ip):
-                                ip = future_to_ip[future]
-                                try:
-                                    res_ip, res_msg = future.result()
-                                    status_text.text(f"Checked {res_ip}: {res_msg}")
-                                except Exception as exc:
-                                    status_text.text(f"Error checking {ip}: {exc}")
+                            done_count = [0]
+                            def on_host_done(n, res):
+                                done_count[0] += 1
+                                status_text.text(f"Checked {hosts[n]['ip']}: {res[2]}")
+                                progress_bar.progress(done_count[0] / total)
+                            
+                            inspections = batch_inspect(hosts, on_result=on_host_done)
+                            
+                            def save_inspection(args):
+                                inst, host, (detected_projs, is_healthy, msg) = args
+                                if instance_keys.get(inst['instance_id']) is False:
+                                    update_instance_health(inst['instance_id'], "Error: Key Decrypt Fail")
+                                    return
+                                if not host['private_key']:
+                                    update_instance_health(inst['instance_id'], "Error: Missing Private Key")
+                                    return
+                                if detected_projs:
+                                    update_instance_projects_status(inst['instance_id'], detected_projs)
+                                update_instance_health(inst['instance_id'], "Healthy" if is_healthy else f"Error: {msg}")
+                            
+                            with ThreadPoolExecutor(max_workers=10) as executor:
+                                list(executor.map(save_inspection, zip(targets, hosts, inspections)))
+                        else:
+                            # Parse each distinct key once before the workers connect
+                            preload_private_keys(k for k in instance_keys.values() if k)
+                            # Use ThreadPoolExecutor for parallel execution
+                            with ThreadPoolExecutor(max_workers=10) as executor:
+                                future_to_ip = {executor.submit(process_instance, inst): inst['ip_address'] for inst in targets}
                                 
-                                completed += 1
-                                progress_bar.progress(completed / total)
+                                for future in as_completed(future_to_ip):
+                                    ip = future_to_ip[future]
+                                    try:
+                                        res_ip, res_msg = future.result()
+                                        status_text.text(f"Checked {res_ip}: {res_msg}")
+                                    except Exception as exc:
+                                        status_text.text(f"Error checking {ip}: {exc}")
+                                    
+                                    completed += 1
+                                    progress_bar.progress(completed / total)
                         
                         status_text.empty()
+                        if not HAS_ASYNCSSH:
+                            ssh_stats = get_ssh_pool_stats()
+                            st.caption(f"SSH 连接池: {ssh_stats['connections']} 个连接 | 复用 {ssh_stats['hits']} / 新建 {ssh_stats['misses']} (命中率 {ssh_stats['hit_rate']:.0%})")
                         st.success("深度检查完成！")
                         time.sleep(1)
                         st.rerun()
                 
+            if st.button("📡 连通性检测", help="并发探测所有运行中实例的 SSH 及项目端口 (TCP)"):
+                targets = [i for i in get_user_instances(user_id) if i['status'] == 'running' and i.get('ip_address')]
+                if not targets:
+                    st.info("没有运行中的实例需检查")
+                else:
+                    with st.spinner(f"正在探测 {len(targets)} 台实例..."):
+                        sweep = sweep_instances(targets)
+                    blocked = [i_id for i_id, r in sweep.items() if not r['reachable']]
+                    if blocked:
+                        st.warning(f"{len(blocked)}/{len(sweep)} 台实例 SSH 不可达: {', '.join(blocked[:20])}")
+                    else:
+                        st.success(f"全部 {len(sweep)} 台实例可达")
+                    if "display_data" in st.session_state:
+                        del st.session_state["display_data"]
+                
         with col_scan:
             if st.button("🌍 全网扫描 & 同步"):
                 # Balance Check removed
@@ -643,11 +822,9 @@ def main():
                     status_text = st.empty()
                     
                     # Prepare tasks
-                    tasks = []
-                    for cred in creds:
-                        if cred.get('status') == 'suspended': continue
-                        for region_code in AMI_MAPPING.keys():
-                            tasks.append((cred, region_code))
+                    # Every enabled region per account (cached describe_regions)
+                    status_text.text("正在获取各账号已启用区域...")
+                    tasks = plan_region_scan([c for c in creds if c.get('status') != 'suspended'])
                     
                     total_tasks = len(tasks)
                     if total_tasks == 0:
@@ -661,17 +838,19 @@ def main():
                         def scan_worker(cred, region_code):
                             try:
                                 proxy_url = cred.get('proxy_url')
-                                aws_instances = scan_all_instances(
-                                    cred['access_key_id'], 
-                                    cred['secret_access_key'], 
-                                    region_code,
-                                    proxy_url=proxy_url
-                                )
-                                
-                                if aws_instances:
+                                # Per-account budget keeps large tenants under the throttle limit
+                                with account_slot(cred['access_key_id']):
+                                    # Stream pages straight into the DB sync
+                                    aws_instances = iter_instances(
+                                        cred['access_key_id'], 
+                                        cred['secret_access_key'], 
+                                        region_code,
+                                        proxy_url=proxy_url
+                                    )
+                                    
                                     res = sync_instances(user_id, cred['id'], region_code, aws_instances)
-                                    return (res['new'], res['updated'], None)
-                                return (0, 0, None)
+                                err = f"{cred['alias_name']}-{region_code}: {res['error']}" if res.get('error') else None
+                                return (res['new'], res['updated'], err)
                             except Exception as e:
                                 return (0, 0, f"{cred['alias_name']}-{region_code}: {str(e)}")
 
@@ -700,6 +879,12 @@ def main():
                         progress_bar.progress(1.0)
                         status_text.empty()
                         st.success(f"扫描完成！新增 {total_new}，更新 {total_updated}。")
+                        pool_stats = get_pool_stats()
+                        throttle_stats = get_throttle_stats()
+                        throttled_total = sum(v['throttled'] for v in throttle_stats.values())
+                        waited_total = sum(v['waited_s'] for v in throttle_stats.values())
+                        throttled_buckets = ", ".join(k for k, v in throttle_stats.items() if v['throttled'])
+                        st.caption(f"连接池: 命中 {pool_stats['hits']} / 新建 {pool_stats['misses']} (命中率 {pool_stats['hit_rate']:.0%}) | 限流: {throttled_total} 次, 排队 {waited_total:.1f}s" + (f" ({throttled_buckets})" if throttled_buckets else ""))
                         # Clear cache to reflect new data
                         if "display_data" in st.session_state:
                             del st.session_state["display_data"]
@@ -727,35 +912,29 @@ def main():
                         if r not in batch_map[c_id]: batch_map[c_id][r] = []
                         batch_map[c_id][r].append(inst['instance_id'])
                     
-                    real_time_status = {}
-                    
-                    # Parallelize Status Check
-
-                    def fetch_status_worker(c_id, cred, r, i_ids):
-                        try:
-                            proxy_url = cred.get('proxy_url')
-                            status_dict = get_instance_status(cred['access_key_id'], cred['secret_access_key'], r, i_ids, proxy_url=proxy_url)
-                            return status_dict
-                        except Exception as e:
-                            print(f"Error fetching status for {cred.get('alias_name')} in {r}: {e}")
-                            return {}
-
-                    with ThreadPoolExecutor(max_workers=50) as executor:
-                        futures = []
-                        for c_id, regions in batch_map.items():
-                            cred = cred_lookup[c_id]
-                            if cred.get('status') == 'suspended': continue
-                            
-                            for r, i_ids in regions.items():
-                                futures.append(executor.submit(fetch_status_worker, c_id, cred, r, i_ids))
+                    # One fleet-wide status call (chunked per account/region)
+                    status_batches = []
+                    for c_id, regions in batch_map.items():
+                        cred = cred_lookup[c_id]
+                        if cred.get('status') == 'suspended': continue
                         
-                        for future in as_completed(futures):
-                            try:
-                                res = future.result()
-                                if res:
-                                    real_time_status.update(res)
-                            except Exception:
-                                pass
+                        for r, i_ids in regions.items():
+                            status_batches.append({
+                                "account": c_id,
+                                "ak": cred['access_key_id'],
+                                "sk": cred['secret_access_key'],
+                                "region": r,
+                                "instance_ids": i_ids,
+                                "proxy_url": cred.get('proxy_url')
+                            })
+                    
+                    fleet = get_fleet_status(status_batches, use_status_api=True, max_workers=50)
+                    real_time_status = fleet['status_map']
+                    for c_id, errs in fleet['errors'].items():
+                        print(f"Error fetching status for {cred_lookup[c_id].get('alias_name')}: {errs}")
+                    slowest = sorted(fleet['timing'].items(), key=lambda x: x[1], reverse=True)[:3]
+                    if slowest:
+                        print("Status refresh slowest accounts: " + ", ".join(f"{cred_lookup[c].get('alias_name')} {t}s" for c, t in slowest))
                     
                     display_data = []
                     for inst in db_instances:
@@ -792,6 +971,8 @@ def main():
                             "IP Address": inst['ip_address'],
                             "Status": current_status,
                             "Health": health,
+                            "Reach": ("—" if inst.get('reachable') is None else
+                                      f"✅ {inst.get('reach_latency_ms') or 0:.0f}ms" if inst['reachable'] else "⛔"),
                             "Titan": "✅" if inst.get('proj_titan') else "⬜",
                             "Nexus": "✅" if inst.get('proj_nexus') else "⬜",
                             "Shardeum": "✅" if inst.get('proj_shardeum') else "⬜",
@@ -802,7 +983,7 @@ def main():
                             "Type": inst.get('instance_type', 'N/A') if 'instance_type' in inst else 'N/A',
                             "Created": inst['created_at'][:16].replace('T', ' '),
                             "_cred_id": inst['credential_id'],
-                            "_has_key": bool(inst.get('private_key'))
+                            "_has_key": bool(inst.get('private_key') or inst.get('key_pair_id'))
                         })
                 
                 st.session_state["display_data"] = display_data
@@ -874,7 +1055,13 @@ def main():
                                             st.error("无法解密私钥")
                                         else:
                                             script = generate_script(target_proj, **input_params)
-                                            res = install_project_via_ssh(target_info['IP Address'], pkey, script)
+                                            # Live view of the last installer lines while it runs
+                                            log_area = st.empty()
+                                            log_lines = []
+                                            def show_line(stream_name, line):
+                                                log_lines.append(line if stream_name == "stdout" else f"[stderr] {line}")
+                                                log_area.code("\n".join(log_lines[-30:]))
+                                            res = install_project_via_ssh(target_info['IP Address'], pkey, script, on_line=show_line)
                                             
                                             if res['status'] == 'success':
                                                 # Map target_proj to keys
@@ -998,34 +1185,41 @@ def main():
                                 progress_bar = st.progress(0)
                                 status_area = st.empty()
                                 results = []
-                                
+
+                                # Map target_proj to keys
+                                db_key = ""
+                                if "Titan" in target_proj: db_key = "Titan"
+                                elif "Nexus" in target_proj: db_key = "Nexus"
+                                elif "Shardeum" in target_proj: db_key = "Shardeum"
+                                elif "Babylon" in target_proj: db_key = "Babylon"
+                                elif "Meson" in target_proj: db_key = "Meson"
+                                elif "Gaga" in target_proj: db_key = "Meson"
+
+                                # Installers run detached on the hosts; workers only upload and start them
+                                install_job_id = install_tracker.new_job()
+                                # The tracker thread writes results with the user's client
+                                install_db_client = get_supabase()
+
                                 def install_worker(i_id, target_data, current_params):
+                                    ip = target_data['IP Address']
                                     try:
                                         script = generate_script(target_proj, **current_params)
                                         pkey = get_instance_private_key(i_id)
                                         
                                         if pkey:
-                                            res = install_project_via_ssh(target_data['IP Address'], pkey, script)
+                                            res = start_install_job(ip, pkey, script)
                                             if res['status'] == 'success':
-                                                # Map target_proj to keys
-                                                db_key = ""
-                                                if "Titan" in target_proj: db_key = "Titan"
-                                                elif "Nexus" in target_proj: db_key = "Nexus"
-                                                elif "Shardeum" in target_proj: db_key = "Shardeum"
-                                                elif "Babylon" in target_proj: db_key = "Babylon"
-                                                elif "Meson" in target_proj: db_key = "Meson"
-                                                elif "Gaga" in target_proj: db_key = "Meson"
-                                                
-                                                if db_key:
-                                                    update_instance_projects_status(i_id, [db_key])
-                                                    
-                                                return f"✅ {target_data['IP Address']}: 指令已发送"
+                                                install_tracker.track(install_job_id, i_id, ip, pkey, res['job_id'], db_key=db_key, db_client=install_db_client)
+                                                return f"✅ {ip}: 安装已在后台启动 (PID {res['pid']})"
                                             else:
-                                                return f"❌ {target_data['IP Address']}: {res['msg']}"
+                                                install_tracker.mark_failed(install_job_id, i_id, ip, res['msg'])
+                                                return f"❌ {ip}: {res['msg']}"
                                         else:
-                                            return f"❌ {target_data['IP Address']}: 无法获取私钥"
+                                            install_tracker.mark_failed(install_job_id, i_id, ip, "无法获取私钥")
+                                            return f"❌ {ip}: 无法获取私钥"
                                     except Exception as e:
-                                        return f"❌ {target_data['IP Address']}: 异常 - {str(e)}"
+                                        install_tracker.mark_failed(install_job_id, i_id, ip, str(e))
+                                        return f"❌ {ip}: 异常 - {str(e)}"
 
                                 with ThreadPoolExecutor(max_workers=20) as executor:
                                     futures = []
@@ -1051,13 +1245,11 @@ def main():
                                         
                                         completed_count += 1
                                         progress_bar.progress(completed_count / total_count)
-                                        status_area.text(f"安装进度: {completed_count}/{total_count}")
-                                
+                                        status_area.text(f"启动进度: {completed_count}/{total_count}")
+
                                 status_area.empty()
-                                # Clear cache
-                                if "display_data" in st.session_state:
-                                    del st.session_state["display_data"]
-                                st.success("批量安装指令发送完成！")
+                                st.session_state["install_job"] = install_job_id
+                                st.success("批量安装已在后台启动！")
                                 with st.expander("查看详细结果", expanded=True):
                                     for r in results:
                                         st.write(r)
@@ -1091,14 +1283,11 @@ def main():
                                         update_instance_health(i_id, "Error: Missing Private Key")
                                         return (ip, "No Key")
                                     
-                                    # 1. Auto-detect
-                                    detected_projs, det_msg = detect_installed_project(ip, pkey)
+                                    # 1. Auto-detect + 2. Check health (one probe round trip)
+                                    detected_projs, is_healthy, msg = inspect_instance(ip, pkey, inst_data['Project (Summary)'] or "")
                                     if detected_projs:
                                         update_instance_projects_status(i_id, detected_projs)
                                     
-                                    # 2. Check health
-                                    check_str = ", ".join(detected_projs) if detected_projs else (inst_data['Project (Summary)'] or "")
-                                    is_healthy, msg = check_instance_process(ip, pkey, check_str)
                                     new_health = "Healthy" if is_healthy else f"Error: {msg}"
                                     update_instance_health(i_id, new_health)
                                     return (ip, "Done")
@@ -1130,6 +1319,26 @@ def main():
                             time.sleep(1)
                             st.rerun()
 
+                # Background install progress (survives reruns)
+                if st.session_state.get("install_job"):
+                    install_progress = install_tracker.progress(st.session_state["install_job"])
+                    if install_progress and install_progress['total']:
+                        st.write("批量安装进度 (后台跟踪):")
+                        settled = install_progress['total'] - install_progress['running']
+                        st.progress(settled / install_progress['total'])
+                        st.caption(f"成功 {install_progress['succeeded']} | 运行中 {install_progress['running']} | 失败/超时 {install_progress['failed']} (共 {install_progress['total']})")
+                        with st.expander("各实例日志 (末尾)"):
+                            for h in install_progress['hosts'].values():
+                                last_line = h['tail'].splitlines()[-1] if h['tail'] else h['msg']
+                                st.text(f"[{h['state']}] {h['ip']}: {last_line}")
+                        if install_progress['done']:
+                            st.success("批量安装全部结束。")
+                            if "display_data" in st.session_state:
+                                del st.session_state["display_data"]
+                            del st.session_state["install_job"]
+                        elif st.button("🔄 刷新安装进度"):
+                            st.rerun()
+
             # Terminate (No balance check needed for cleanup?)
             st.divider()
             st.subheader("⚠️ 危险操作")
@@ -1163,42 +1372,54 @@ def main():
                 status_area = st.empty()
                 results = []
                 
-                def terminate_worker(i_id):
+                # Group the selection by (credential, region): one TerminateInstances
+                # call and one DELETE per group instead of two round trips per ID
+                term_groups = {}
+                for i_id in instances_to_term:
                     target = next((d for d in display_data if d['Instance ID'] == i_id), None)
                     if not target:
-                        return f"❌ {i_id}: 未找到实例数据"
-                    
-                    cred = cred_lookup.get(target['_cred_id'])
+                        results.append(f"❌ {i_id}: 未找到实例数据")
+                        continue
+                    term_groups.setdefault((target['_cred_id'], target['Region']), []).append(i_id)
+
+                def terminate_worker(cred_id, region, ids):
+                    cred = cred_lookup.get(cred_id)
                     if not cred:
-                        return f"❌ {i_id}: 未找到凭证"
-                        
+                        return [f"❌ {i_id}: 未找到凭证" for i_id in ids]
+
                     try:
-                        proxy_url = cred.get('proxy_url')
-                        res = terminate_instance(cred['access_key_id'], cred['secret_access_key'], target['Region'], i_id, proxy_url=proxy_url)
-                        if res['status'] == 'success':
-                            # Directly delete the record as requested
-                            delete_instance(i_id)
-                            return f"✅ {i_id}: 已发送关闭指令并删除记录"
-                        else:
-                            return f"❌ {i_id}: 关闭失败 - {res['msg']}"
+                        res = terminate_instances(cred['access_key_id'], cred['secret_access_key'], region, ids, proxy_url=cred.get('proxy_url'))
+                        # Gone from AWS already -> the record is stale too
+                        done_ids = [i_id for i_id in ids if res[i_id]['status'] in ('success', 'not_found')]
+                        delete_instances(done_ids, credential_id=cred_id)
+
+                        lines = []
+                        for i_id in ids:
+                            r = res[i_id]
+                            if r['status'] == 'success':
+                                lines.append(f"✅ {i_id}: 已发送关闭指令并删除记录")
+                            elif r['status'] == 'not_found':
+                                lines.append(f"✅ {i_id}: AWS 中已不存在，已删除记录")
+                            else:
+                                lines.append(f"❌ {i_id}: 关闭失败 - {r['msg']}")
+                        return lines
                     except Exception as e:
-                        return f"❌ {i_id}: 异常 - {str(e)}"
+                        return [f"❌ {i_id}: 异常 - {str(e)}" for i_id in ids]
 
                 with ThreadPoolExecutor(max_workers=20) as executor:
-                    futures = [executor.submit(terminate_worker, i_id) for i_id in instances_to_term]
+                    futures = {executor.submit(terminate_worker, cred_id, region, ids): ids for (cred_id, region), ids in term_groups.items()}
                     
                     completed_count = 0
-                    total_count = len(futures)
+                    total_count = len(instances_to_term)
                     
                     for future in as_completed(futures):
                         try:
-                            res = future.result()
-                            results.append(res)
+                            results.extend(future.result())
                         except Exception as e:
                             results.append(f"❌ (Unknown): {e}")
                         
-                        completed_count += 1
-                        progress_bar.progress(completed_count / total_count)
+                        completed_count += len(futures[future])
+                        progress_bar.progress(min(1.0, completed_count / total_count))
                         status_area.text(f"处理进度: {completed_count}/{total_count}")
                 
                 status_area.empty()
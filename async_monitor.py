@@ -0,0 +1,241 @@
+"""
+asyncio SSH backend for fleet-wide operations.
+
+Same per-host API as monitor.py (check_instance_process, detect_installed_project,
+install_project_via_ssh, inspect_instance) as coroutines, plus batch variants that
+run hundreds of sessions on one event loop with a per-host timeout and a global
+concurrency limit. Needs asyncssh (in requirements.txt); callers still check
+HAS_ASYNCSSH and fall back to the threaded paramiko path in monitor.py if the
+import fails.
+"""
+import asyncio
+from collections import deque
+from monitor import INSTALL_SCRIPT_PATH, INSTALL_TAIL_LINES, PROBE_COMMAND, PROBE_SCRIPT, PROBE_SERVICES, PROBE_PROCESSES, PrivateKeyCache, decode_script, parse_probe_output, projects_from_probe, check_from_probe
+
+try:
+    import asyncssh
+    HAS_ASYNCSSH = True
+except ImportError:
+    asyncssh = None
+    HAS_ASYNCSSH = False
+
+# Sessions open at the same time across the whole batch
+ASYNC_SSH_CONCURRENCY = 200
+ASYNC_SSH_CONNECT_TIMEOUT = 10
+ASYNC_SSH_KEEPALIVE = 30
+# Whole-host budget (connect + commands) for probes and checks
+ASYNC_SSH_HOST_TIMEOUT = 60
+# Install scripts pull images/binaries and run much longer
+ASYNC_SSH_INSTALL_TIMEOUT = 1800
+
+
+def _require_asyncssh():
+    if not HAS_ASYNCSSH:
+        raise RuntimeError("asyncssh is not installed (pip install asyncssh)")
+
+def _import_key(private_key_str):
+    """Parse a private key. Raises ValueError with the parser's message."""
+    try:
+        return asyncssh.import_private_key(private_key_str)
+    except (asyncssh.KeyImportError, ValueError) as e:
+        raise ValueError(str(e))
+
+# asyncssh key objects, same fingerprint LRU as monitor.pkey_cache
+pkey_cache = PrivateKeyCache(_import_key)
+
+def _load_key(private_key_str):
+    return pkey_cache.get(private_key_str)
+
+async def _connect(ip, private_key_str, user):
+    key = _load_key(private_key_str)
+    return await asyncssh.connect(
+        ip, username=user, client_keys=[key], known_hosts=None,
+        connect_timeout=ASYNC_SSH_CONNECT_TIMEOUT, keepalive_interval=ASYNC_SSH_KEEPALIVE
+    )
+
+async def _legacy_probe(conn):
+    """Per-command fallback when the probe output can't be parsed."""
+    async def run(cmd):
+        result = await conn.run(cmd, check=False)
+        return (result.stdout or '').strip()
+
+    return {
+        "containers": (await run("sudo docker ps --format '{{.Names}}'")).split(),
+        "services": {svc: await run(f"systemctl is-active {svc}") for svc in PROBE_SERVICES},
+        "processes": {proc: bool(await run(f"pgrep -f {proc}")) for proc in PROBE_PROCESSES}
+    }
+
+async def probe_host(conn):
+    """Async monitor.probe_host: one round trip for containers, services and processes."""
+    result = await conn.run(PROBE_COMMAND, input=PROBE_SCRIPT, check=False)
+    probe = parse_probe_output(result.stdout or '')
+    return probe if probe is not None else await _legacy_probe(conn)
+
+
+# --- Per-host API (mirrors monitor.py) ---
+
+async def check_instance_process(ip, private_key_str, project_name, user='ec2-user'):
+    """Returns: (is_healthy: bool, msg: str)"""
+    if not ip or not private_key_str:
+        return False, "Missing IP or Private Key"
+    try:
+        async with await _connect(ip, private_key_str, user) as conn:
+            probe = await probe_host(conn)
+    except ValueError as e:
+        return False, f"Invalid Key Format: {e}"
+    except Exception as e:
+        return False, f"SSH Connection Failed: {str(e)}"
+    return check_from_probe(probe, project_name)
+
+async def detect_installed_project(ip, private_key_str, user='ec2-user'):
+    """Returns: (project_keys: list[str] | None, msg: str)"""
+    if not ip or not private_key_str:
+        return None, "Missing IP or Private Key"
+    try:
+        async with await _connect(ip, private_key_str, user) as conn:
+            probe = await probe_host(conn)
+    except ValueError as e:
+        return None, f"Invalid Key: {e}"
+    except Exception as e:
+        return None, f"SSH Connection Failed: {str(e)}"
+
+    found_projects, msgs = projects_from_probe(probe)
+    if found_projects:
+        return found_projects, f"Found: {', '.join(msgs)}"
+    return [], "No known project detected"
+
+async def inspect_instance(ip, private_key_str, project_name="", user='ec2-user'):
+    """Returns: (project_keys: list[str] | None, is_healthy: bool, msg: str)"""
+    if not ip or not private_key_str:
+        return None, False, "Missing IP or Private Key"
+    try:
+        async with await _connect(ip, private_key_str, user) as conn:
+            probe = await probe_host(conn)
+    except ValueError as e:
+        return None, False, f"Invalid Key Format: {e}"
+    except Exception as e:
+        return None, False, f"SSH Connection Failed: {str(e)}"
+
+    found_projects, _ = projects_from_probe(probe)
+    check_str = ", ".join(found_projects) if found_projects else (project_name or "")
+    is_healthy, msg = check_from_probe(probe, check_str)
+    return found_projects, is_healthy, msg
+
+async def upload_script(conn, script_content, path=INSTALL_SCRIPT_PATH):
+    """Async monitor.upload_script: SFTP, or stdin of `cat` without the subsystem."""
+    try:
+        async with conn.start_sftp_client() as sftp:
+            async with sftp.open(path, 'w') as f:
+                await f.write(script_content)
+            await sftp.chmod(path, 0o755)
+        return
+    except (asyncssh.ChannelOpenError, asyncssh.SFTPError):
+        pass
+    result = await conn.run(f"cat > {path} && chmod +x {path}", input=script_content, check=False)
+    if result.exit_status != 0:
+        raise RuntimeError(f"Script upload failed: {(result.stderr or '').strip()}")
+
+async def install_project_via_ssh(ip, private_key_str, script_base64, user='ec2-user', on_line=None, tail_lines=INSTALL_TAIL_LINES):
+    """
+    Returns: {status, msg, output, error, exit_code}
+    on_line(stream, line) fires per output line; only the tails are kept.
+    """
+    if not ip or not private_key_str:
+        return {"status": "error", "msg": "Missing IP or Private Key"}
+
+    script_content = decode_script(script_base64)
+    tails = {"stdout": deque(maxlen=tail_lines), "stderr": deque(maxlen=tail_lines)}
+
+    async def pump(name, reader):
+        async for line in reader:
+            line = line.rstrip("\r\n")
+            tails[name].append(line)
+            if on_line:
+                on_line(name, line)
+
+    try:
+        async with await _connect(ip, private_key_str, user) as conn:
+            await upload_script(conn, script_content)
+            process = await conn.create_process(f"sudo {INSTALL_SCRIPT_PATH}", encoding='utf-8', errors='replace')
+            await asyncio.gather(pump("stdout", process.stdout), pump("stderr", process.stderr))
+            completed = await process.wait(check=False)
+        return {
+            "status": "success", "msg": "Script executed",
+            "output": "\n".join(tails["stdout"]), "error": "\n".join(tails["stderr"]),
+            "exit_code": completed.exit_status
+        }
+    except ValueError as e:
+        return {"status": "error", "msg": f"Invalid Key: {e}"}
+    except Exception as e:
+        return {"status": "error", "msg": f"SSH Execution Failed: {str(e)}"}
+
+
+# --- Batch API ---
+# hosts: list of dicts {ip, private_key, project_name?, script?, user?}
+# Results come back in input order; on_result(index, result) fires as each host finishes.
+
+async def _run_batch(worker, hosts, timeout_result, concurrency, timeout, on_result):
+    _require_asyncssh()
+    # Parse each distinct key once before the sessions start
+    pkey_cache.preload(h.get('private_key') for h in hosts)
+    sem = asyncio.Semaphore(concurrency)
+    results = [None] * len(hosts)
+
+    async def one(n, host):
+        async with sem:
+            try:
+                res = await asyncio.wait_for(worker(host), timeout)
+            except asyncio.TimeoutError:
+                res = timeout_result
+        results[n] = res
+        if on_result:
+            on_result(n, res)
+
+    await asyncio.gather(*(one(n, h) for n, h in enumerate(hosts)))
+    return results
+
+async def batch_inspect_async(hosts, concurrency=ASYNC_SSH_CONCURRENCY, timeout=ASYNC_SSH_HOST_TIMEOUT, on_result=None):
+    return await _run_batch(
+        lambda h: inspect_instance(h['ip'], h['private_key'], h.get('project_name') or "", h.get('user', 'ec2-user')),
+        hosts, (None, False, f"Timed out after {timeout}s"), concurrency, timeout, on_result
+    )
+
+async def batch_check_async(hosts, concurrency=ASYNC_SSH_CONCURRENCY, timeout=ASYNC_SSH_HOST_TIMEOUT, on_result=None):
+    return await _run_batch(
+        lambda h: check_instance_process(h['ip'], h['private_key'], h.get('project_name') or "", h.get('user', 'ec2-user')),
+        hosts, (False, f"Timed out after {timeout}s"), concurrency, timeout, on_result
+    )
+
+async def batch_detect_async(hosts, concurrency=ASYNC_SSH_CONCURRENCY, timeout=ASYNC_SSH_HOST_TIMEOUT, on_result=None):
+    return await _run_batch(
+        lambda h: detect_installed_project(h['ip'], h['private_key'], h.get('user', 'ec2-user')),
+        hosts, (None, f"Timed out after {timeout}s"), concurrency, timeout, on_result
+    )
+
+async def batch_install_async(hosts, concurrency=ASYNC_SSH_CONCURRENCY, timeout=ASYNC_SSH_INSTALL_TIMEOUT, on_result=None, on_line=None):
+    """on_line(index, stream, line) streams every host's install output."""
+    index = {id(h): n for n, h in enumerate(hosts)}
+
+    def host_lines(h):
+        if not on_line:
+            return None
+        return lambda stream, line: on_line(index[id(h)], stream, line)
+
+    return await _run_batch(
+        lambda h: install_project_via_ssh(h['ip'], h['private_key'], h['script'], h.get('user', 'ec2-user'), on_line=host_lines(h)),
+        hosts, {"status": "error", "msg": f"SSH Execution Failed: timed out after {timeout}s"}, concurrency, timeout, on_result
+    )
+
+# Blocking entry points for Streamlit (the script thread has no running loop)
+
+def batch_inspect(hosts, **kwargs):
+    return asyncio.run(batch_inspect_async(hosts, **kwargs))
+
+def batch_check(hosts, **kwargs):
+    return asyncio.run(batch_check_async(hosts, **kwargs))
+
+def batch_detect(hosts, **kwargs):
+    return asyncio.run(batch_detect_async(hosts, **kwargs))
+
+def batch_install(hosts, **kwargs):
+    return asyncio.run(batch_install_async(hosts, **kwargs))
@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+
+# Directory for caches that survive process restarts
+CACHE_DIR = os.environ.get("DEPIN_CACHE_DIR", ".cache")
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache with per-entry expiry.
+    Used for AWS metadata that changes rarely (regions, quotas, images...).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = {}  # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if not item:
+                return default
+            if item[0] < time.time():
+                del self._data[key]
+                return default
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (ttl if ttl is not None else self.ttl), value)
+
+    def set_many(self, items, ttl=None):
+        """Set several {key: value} entries at once."""
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            for key, value in items.items():
+                self._data[key] = (expires_at, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry whose key matches predicate(key)."""
+        with self._lock:
+            for k in [k for k in self._data if predicate(k)]:
+                del self._data[k]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class PersistentTTLCache(TTLCache):
+    """
+    TTLCache mirrored to a JSON file under CACHE_DIR, so warm data survives
+    Streamlit restarts. Keys must be strings and values JSON-serializable.
+    """
+
+    def __init__(self, name, ttl):
+        super().__init__(ttl)
+        self.path = os.path.join(CACHE_DIR, f"{name}.json")
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                raw = json.load(f)
+        except Exception:
+            return
+        now = time.time()
+        with self._lock:
+            for k, (expires_at, value) in raw.items():
+                if expires_at > now:
+                    self._data[k] = (expires_at, value)
+
+    def _save(self):
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._data.items()}
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Cache save failed ({self.path}): {e}")
+
+    def set(self, key, value, ttl=None):
+        super().set(key, value, ttl)
+        self._save()
+
+    def set_many(self, items, ttl=None, save=True):
+        """
+        Set several entries with one file write. save=False only updates
+        memory; call flush() once the batch is complete.
+        """
+        super().set_many(items, ttl)
+        if save:
+            self._save()
+
+    def flush(self):
+        self._save()
+
+    def invalidate(self, key):
+        super().invalidate(key)
+        self._save()
+
+    def invalidate_where(self, predicate):
+        super().invalidate_where(predicate)
+        self._save()
+
+    def clear(self):
+        super().clear()
+        self._save()
@@ -0,0 +1,312 @@
+import random
+import threading
+import time
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Idle clients are dropped after this many seconds without use
+CLIENT_IDLE_TTL = 900
+# How often (seconds) the pool sweeps for idle clients
+EVICT_INTERVAL = 60
+# HTTP connections kept per client (botocore default is 10)
+MAX_POOL_CONNECTIONS = 50
+# botocore 'standard' retry mode: exponential backoff with jitter on throttling
+MAX_ATTEMPTS = 8
+
+# --- Rate Limiting ---
+THROTTLE_CODES = (
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded',
+    'RequestThrottled', 'RequestThrottledException', 'TooManyRequestsException',
+    'SlowDown', 'PriorRequestNotComplete', 'EC2ThrottledException'
+)
+# EC2 meters API families with separate token buckets.
+# (refill rate per second, burst) - conservative shares of the AWS defaults
+FAMILY_LIMITS = {
+    'describe': (20.0, 50),
+    'mutate': (5.0, 20),
+    'run': (2.0, 10),
+    'default': (10.0, 20),
+}
+# Resource-intensive EC2 actions
+RUN_OPERATIONS = ('RunInstances', 'TerminateInstances', 'StartInstances', 'StopInstances', 'CreateFleet')
+MIN_RATE = 0.2
+RATE_INCREASE = 0.1  # additive increase per successful call
+
+
+def api_family(service, operation):
+    """Map an operation to its throttling bucket."""
+    if service != 'ec2':
+        return 'default'
+    if operation in RUN_OPERATIONS:
+        return 'run'
+    if operation.startswith(('Describe', 'Get')):
+        return 'describe'
+    return 'mutate'
+
+
+def is_throttling_error(e):
+    """True if an exception is AWS rate limiting (after retries were exhausted)."""
+    return isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') in THROTTLE_CODES
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket whose refill rate halves on throttling and creeps back up
+    on success (AIMD). Shared by every thread calling the same account/family.
+    """
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+        self.waited = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.calls += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            # Jitter spreads waiting threads so they don't wake in lockstep
+            wait *= random.uniform(1.0, 1.5)
+            with self._lock:
+                self.waited += wait
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(MIN_RATE, self.rate * 0.5)
+            self.tokens = min(self.tokens, 0)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "rate": round(self.rate, 2),
+                "waited_s": round(self.waited, 2)
+            }
+
+
+class RateLimiter:
+    """Token buckets keyed by (access_key, region, family)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._op_calls = {}  # (service, operation) -> HTTP attempts
+
+    def bucket(self, ak, region, family):
+        key = (ak, region, family)
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                rate, burst = FAMILY_LIMITS.get(family, FAMILY_LIMITS['default'])
+                b = AdaptiveTokenBucket(rate, burst)
+                self._buckets[key] = b
+            return b
+
+    def attach(self, client, ak, region):
+        """Hook a client: take a token before every attempt, adapt on the outcome."""
+        service = client.meta.service_model.service_name
+
+        def before_send(event_name=None, **kwargs):
+            operation = event_name.rsplit('.', 1)[-1]
+            with self._lock:
+                self._op_calls[(service, operation)] = self._op_calls.get((service, operation), 0) + 1
+            self.bucket(ak, region, api_family(service, operation)).acquire()
+
+        def needs_retry(event_name=None, response=None, **kwargs):
+            operation = event_name.rsplit('.', 1)[-1]
+            b = self.bucket(ak, region, api_family(service, operation))
+            code = None
+            if response is not None:
+                code = (response[1] or {}).get('Error', {}).get('Code')
+            if code in THROTTLE_CODES:
+                b.on_throttle()
+            elif code is None:
+                b.on_success()
+            # Never decide the retry ourselves; botocore's retry handler does
+            return None
+
+        client.meta.events.register('before-send', before_send)
+        client.meta.events.register('needs-retry', needs_retry)
+
+    def call_stats(self):
+        """HTTP attempts (retries included) per 'service.Operation'."""
+        with self._lock:
+            return {f"{svc}.{op}": n for (svc, op), n in self._op_calls.items()}
+
+    def reset_call_stats(self):
+        with self._lock:
+            self._op_calls.clear()
+
+    def stats(self):
+        """Throttle counters per account/region/family (access key shortened)."""
+        with self._lock:
+            items = list(self._buckets.items())
+        return {f"{ak[:8]}…|{region}|{family}": b.stats() for (ak, region, family), b in items}
+
+
+_limiter = RateLimiter()
+
+
+class ClientPool:
+    """
+    Process-wide cache of boto3 clients.
+    Keyed by (access_key, region, proxy_url, service) so repeated calls reuse
+    the underlying HTTP connection pool. Every credential shares one boto3
+    Session, so each service model is loaded from disk once per process.
+    boto3 clients are thread-safe once created; a cache hit never waits on a
+    client being built, and the same key is only built once at a time.
+    """
+
+    def __init__(self, idle_ttl=CLIENT_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        # botocore sessions aren't thread-safe: creation goes through _session_lock,
+        # which is cheap once the shared loader has the service model cached
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._key_locks = {}  # key -> Lock (single-flight creation)
+        self._clients = {}    # key -> {"client", "sk", "last_used"}
+        self._last_evict = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _build_config(self, proxy_url):
+        params = {
+            "max_pool_connections": MAX_POOL_CONNECTIONS,
+            "retries": {"mode": "standard", "max_attempts": MAX_ATTEMPTS}
+        }
+        if proxy_url:
+            params["proxies"] = {'https': proxy_url, 'http': proxy_url}
+        return Config(**params)
+
+    def _lookup_locked(self, key, sk, now):
+        entry = self._clients.get(key)
+        # Secret key rotated for the same AK -> rebuild
+        if entry and entry["sk"] == sk:
+            entry["last_used"] = now
+            self.hits += 1
+            return entry["client"]
+        return None
+
+    def _create_client(self, ak, sk, region, service, proxy_url):
+        with self._session_lock:
+            if self._session is None:
+                self._session = boto3.Session()
+            return self._session.client(
+                service, region_name=region, config=self._build_config(proxy_url),
+                aws_access_key_id=ak, aws_secret_access_key=sk
+            )
+
+    def get_client(self, ak, sk, region, service='ec2', proxy_url=None):
+        """Return a cached client, creating it on first use."""
+        key = (ak, region, proxy_url or None, service)
+        now = time.time()
+
+        with self._lock:
+            if now - self._last_evict > EVICT_INTERVAL:
+                self._evict_idle_locked(now)
+            client = self._lookup_locked(key, sk, now)
+            if client:
+                return client
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                # Built by another thread while we waited
+                client = self._lookup_locked(key, sk, time.time())
+                if client:
+                    return client
+                self.misses += 1
+
+            client = self._create_client(ak, sk, region, service, proxy_url)
+            _limiter.attach(client, ak, region)
+            with self._lock:
+                self._clients[key] = {"client": client, "sk": sk, "last_used": time.time()}
+            return client
+
+    def _evict_idle_locked(self, now):
+        stale = [k for k, v in self._clients.items() if now - v["last_used"] > self.idle_ttl]
+        for k in stale:
+            del self._clients[k]
+            self.evictions += 1
+
+        for k in [k for k, l in self._key_locks.items() if k not in self._clients and not l.locked()]:
+            del self._key_locks[k]
+
+        self._last_evict = now
+
+    def evict_idle(self):
+        """Force an idle sweep (normally done lazily on access)."""
+        with self._lock:
+            self._evict_idle_locked(time.time())
+
+    def invalidate(self, ak):
+        """Drop every client for an access key (e.g. credential deleted/edited)."""
+        with self._lock:
+            for k in [k for k in self._clients if k[0] == ak]:
+                del self._clients[k]
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self):
+        """Return hit/miss counters for monitoring."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "clients": len(self._clients),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0
+            }
+
+
+# Shared pool for the whole process (Streamlit reruns reuse the module)
+_pool = ClientPool()
+
+def get_client(ak, sk, region, service='ec2', proxy_url=None):
+    """Get a pooled boto3 client for (credential, region, proxy, service)."""
+    return _pool.get_client(ak, sk, region, service=service, proxy_url=proxy_url)
+
+def get_pool_stats():
+    """Hit/miss counters of the shared client pool."""
+    return _pool.stats()
+
+def invalidate_credential(ak):
+    """Remove pooled clients for an access key."""
+    _pool.invalidate(ak)
+
+def get_throttle_stats():
+    """Per account/region/API-family call and throttle counters."""
+    return _limiter.stats()
+
+def get_api_call_stats():
+    """AWS API attempts per 'service.Operation' since start (or last reset)."""
+    return _limiter.call_stats()
+
+def reset_api_call_stats():
+    _limiter.reset_call_stats()
@@ -0,0 +1,178 @@
+"""
+Benchmark the AWS layer (logic.py) without real accounts.
+
+Runs the hot paths against moto's in-process EC2 / SSM / Service Quotas
+backends, seeded with a configurable fleet, and reports latency percentiles
+and AWS API calls per operation. Every credential is a separate moto account
+(via STS assume_role), so scans only see their own instances.
+
+Usage:
+    python benchmark_aws.py --accounts 20 --regions us-east-1,us-west-2 --instances 50
+    python benchmark_aws.py --json bench.json --baseline previous.json
+
+Requires moto (pip install "moto[ec2,ssm,sts]"); it is not an app dependency.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Fake credentials and an isolated disk cache before logic/aws_cache are imported
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ["DEPIN_CACHE_DIR"] = tempfile.mkdtemp(prefix="depin-bench-")
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    print("moto is required: pip install \"moto[ec2,ssm,sts]\"")
+    sys.exit(1)
+
+SEED_IMAGE_ID = 'ami-12c6146b'  # Present in moto's default AMI set
+OPERATIONS = ('scan_all_instances', 'get_instance_status', 'check_capacity', 'launch_base_instance', 'terminate_instance')
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def seed(accounts, regions, instances):
+    """Create one moto account per credential and launch the fleet. Returns [cred]."""
+    sts = boto3.client('sts', region_name='us-east-1')
+    creds = []
+    for n in range(accounts):
+        account_id = f"{100000000000 + n}"
+        role = sts.assume_role(RoleArn=f"arn:aws:iam::{account_id}:role/bench", RoleSessionName=f"bench-{n}")['Credentials']
+        cred = {"ak": role['AccessKeyId'], "sk": role['SecretAccessKey'], "token": role['SessionToken'], "instances": {}}
+        for region in regions:
+            ec2 = boto3.client(
+                'ec2', region_name=region,
+                aws_access_key_id=cred['ak'], aws_secret_access_key=cred['sk'], aws_session_token=cred['token']
+            )
+            ids = []
+            remaining = instances
+            while remaining > 0:
+                batch = min(remaining, 100)
+                response = ec2.run_instances(ImageId=SEED_IMAGE_ID, InstanceType='t3.micro', MinCount=batch, MaxCount=batch)
+                ids.extend(i['InstanceId'] for i in response['Instances'])
+                remaining -= batch
+            cred['instances'][region] = ids
+        creds.append(cred)
+    return creds
+
+
+def run(args):
+    import logic
+    from aws_pool import get_api_call_stats, reset_api_call_stats
+
+    regions = [r.strip() for r in args.regions.split(',') if r.strip()]
+    t0 = time.perf_counter()
+    creds = seed(args.accounts, regions, args.instances)
+    seed_s = time.perf_counter() - t0
+
+    latencies = {op: [] for op in OPERATIONS}
+    api_calls = {op: {} for op in OPERATIONS}
+
+    def measure(op, fn, *a, **kw):
+        before = get_api_call_stats()
+        start = time.perf_counter()
+        result = fn(*a, **kw)
+        latencies[op].append((time.perf_counter() - start) * 1000)
+        for name, n in get_api_call_stats().items():
+            delta = n - before.get(name, 0)
+            if delta:
+                api_calls[op][name] = api_calls[op].get(name, 0) + delta
+        return result
+
+    reset_api_call_stats()
+    for _ in range(args.iterations):
+        for cred in creds:
+            for region in regions:
+                ak, sk = cred['ak'], cred['sk']
+                measure('scan_all_instances', logic.scan_all_instances, ak, sk, region)
+                measure('get_instance_status', logic.get_instance_status, ak, sk, region, cred['instances'][region])
+                measure('check_capacity', logic.check_capacity, ak, sk, region)
+                if args.launches:
+                    res = measure('launch_base_instance', logic.launch_base_instance, ak, sk, region, instance_type='t3.micro')
+                    if res.get('status') == 'success':
+                        measure('terminate_instance', logic.terminate_instance, ak, sk, region, res['id'])
+
+    calls_per_op = {op: sum(c.values()) for op, c in api_calls.items()}
+    report = {
+        "config": {"accounts": args.accounts, "regions": regions, "instances": args.instances, "iterations": args.iterations},
+        "seed_s": round(seed_s, 2),
+        "operations": {}
+    }
+    for op in OPERATIONS:
+        values = latencies[op]
+        if not values:
+            continue
+        report["operations"][op] = {
+            "count": len(values),
+            "mean_ms": round(statistics.mean(values), 2),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p90_ms": round(percentile(values, 90), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+            "api_calls": calls_per_op[op],
+            "api_calls_per_op": round(calls_per_op[op] / len(values), 2),
+            "api_breakdown": api_calls[op]
+        }
+    return report
+
+
+def print_report(report, baseline=None):
+    cfg = report["config"]
+    print(f"Fleet: {cfg['accounts']} accounts x {len(cfg['regions'])} regions x {cfg['instances']} instances, "
+          f"{cfg['iterations']} iterations (seeded in {report['seed_s']}s)")
+    header = f"{'operation':<22}{'count':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'calls/op':>10}"
+    if baseline:
+        header += f"{'Δp50':>9}{'Δcalls':>9}"
+    print(header)
+    print('-' * len(header))
+    for op, s in report["operations"].items():
+        line = f"{op:<22}{s['count']:>7}{s['p50_ms']:>10.2f}{s['p90_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['api_calls_per_op']:>10.2f}"
+        base = (baseline or {}).get("operations", {}).get(op)
+        if base:
+            d_p50 = (s['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100 if base['p50_ms'] else 0.0
+            line += f"{d_p50:>8.1f}%{s['api_calls_per_op'] - base['api_calls_per_op']:>+9.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark logic.py against moto")
+    parser.add_argument("--accounts", type=int, default=10, help="Credentials (moto accounts) to seed")
+    parser.add_argument("--regions", default="us-east-1,us-west-2", help="Comma separated regions")
+    parser.add_argument("--instances", type=int, default=50, help="Instances per account and region")
+    parser.add_argument("--iterations", type=int, default=3, help="Passes over every account/region")
+    parser.add_argument("--no-launches", dest="launches", action="store_false", help="Skip launch/terminate")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--baseline", help="Previous --json report to compare against")
+    args = parser.parse_args()
+
+    with mock_aws():
+        report = run(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
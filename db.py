@@ -1,7 +1,9 @@
 import os
+import threading
 import streamlit as st
 from supabase import create_client, Client, ClientOptions
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from crypto import encrypt_key, decrypt_key
 
 # Initialize Supabase client
@@ -272,6 +274,31 @@ def delete_instance(instance_id):
     except Exception as e:
         print(f"Error deleting instance: {e}")
 
+# IDs per `in_` filter: PostgREST puts the list in the URL (~22 bytes per ID)
+IN_FILTER_CHUNK = 150
+
+def delete_instances(instance_ids, credential_id=None, client=None):
+    """
+    Delete many instance records, IN_FILTER_CHUNK IDs per DELETE ... WHERE instance_id IN (...).
+    Returns the number of IDs deleted (chunks that fail are skipped and logged).
+    """
+    if not instance_ids: return 0
+    client = client or get_supabase()
+    if not client: return 0
+    instance_ids = list(instance_ids)
+    deleted = 0
+    for i in range(0, len(instance_ids), IN_FILTER_CHUNK):
+        chunk = instance_ids[i:i + IN_FILTER_CHUNK]
+        try:
+            query = client.table("instances").delete()
+            if credential_id:
+                query = query.eq("credential_id", credential_id)
+            query.in_("instance_id", chunk).execute()
+            deleted += len(chunk)
+        except Exception as e:
+            print(f"Error deleting instances: {e}")
+    return deleted
+
 def get_credential_vcpu_usage(credential_id):
     """
     Calculate total vCPU usage for a credential based on local DB.
@@ -282,7 +309,7 @@ def get_credential_vcpu_usage(credential_id):
     try:
         # Fetch vcpu_count for all active instances
         response = client.table("instances") \
-            .select("vcpu_count") \
+            .select("vcpu_count, instance_type") \
             .eq("credential_id", credential_id) \
             .neq("status", "terminated") \
             .neq("status", "shutting-down") \
@@ -290,8 +317,12 @@ def get_credential_vcpu_usage(credential_id):
         
         total = 0
         if response.data:
+            catalog = get_instance_type_catalog()
             for row in response.data:
                 count = row.get("vcpu_count")
+                if not count:
+                    # 0/None (e.g. custom types) -> look up the type catalog
+                    count = (catalog.get(row.get("instance_type")) or {}).get("vcpu")
                 if count: # Handle None
                     total += int(count)
         return total
@@ -300,6 +331,97 @@ def get_credential_vcpu_usage(credential_id):
         return 0
 
 
+# --- SSH Key Pairs (one per credential/region) ---
+
+# Encrypted key material per key_pair_id -> (credential_id, ciphertext), so batch
+# SSH reads each registered key once; decrypted per call, never kept in memory
+_key_material_cache = {}
+_key_material_lock = threading.Lock()
+
+def get_key_pair(credential_id, region):
+    """Registered key pair row (id, key_name, fingerprint) for (credential, region) or None."""
+    client = get_supabase()
+    if not client: return None
+    try:
+        response = client.table("aws_key_pairs") \
+            .select("id, key_name, fingerprint") \
+            .eq("credential_id", credential_id) \
+            .eq("region", region) \
+            .limit(1) \
+            .execute()
+        return response.data[0] if response.data else None
+    except Exception as e:
+        print(f"Error fetching key pair: {e}")
+        return None
+
+def save_key_pair(user_id, credential_id, region, key_name, private_key, fingerprint=None):
+    """Store an imported key pair (private key encrypted). Returns the row or raises."""
+    client = get_supabase()
+    if not client:
+        raise RuntimeError("Database connection failed")
+
+    response = client.table("aws_key_pairs").insert({
+        "user_id": user_id,
+        "credential_id": credential_id,
+        "region": region,
+        "key_name": key_name,
+        "private_key": encrypt_key(private_key),
+        "fingerprint": fingerprint
+    }).execute()
+    row = response.data[0]
+    with _key_material_lock:
+        _key_material_cache[row['id']] = (credential_id, row.get('private_key'))
+    return row
+
+def get_key_pair_private_key(key_pair_id, encrypted=None):
+    """
+    Decrypted private key of a registered key pair (ciphertext cached per process).
+    encrypted: pass the already-fetched ciphertext to skip the DB read.
+    """
+    if not key_pair_id: return None
+    if encrypted is None:
+        with _key_material_lock:
+            cached = _key_material_cache.get(key_pair_id)
+        if cached:
+            encrypted = cached[1]
+
+    if encrypted is None:
+        client = get_supabase()
+        if not client: return None
+        try:
+            response = client.table("aws_key_pairs") \
+                .select("credential_id, private_key") \
+                .eq("id", key_pair_id) \
+                .single() \
+                .execute()
+            encrypted = response.data.get("private_key") if response.data else None
+        except Exception as e:
+            print(f"Error fetching key pair private key: {e}")
+            return None
+        if encrypted:
+            with _key_material_lock:
+                _key_material_cache[key_pair_id] = (response.data.get("credential_id"), encrypted)
+
+    return decrypt_key(encrypted) if encrypted else None
+
+def forget_key_pair_material(credential_id):
+    """Drop cached key material of a credential (deleted/edited)."""
+    with _key_material_lock:
+        for k in [k for k, v in _key_material_cache.items() if v[0] == credential_id]:
+            del _key_material_cache[k]
+
+def resolve_instance_key(inst):
+    """
+    Private key for an instance row from get_user_instances.
+    Legacy rows carry their own encrypted key; newer rows reference aws_key_pairs.
+    """
+    if inst.get('private_key'):
+        return decrypt_key(inst['private_key'])
+    if inst.get('key_pair_id'):
+        joined = inst.get('aws_key_pairs') or {}
+        return get_key_pair_private_key(inst['key_pair_id'], encrypted=joined.get('private_key'))
+    return None
+
 # --- Instance Management ---
 
 def get_all_instance_types():
@@ -313,6 +435,91 @@ def get_all_instance_types():
         print(f"Error fetching instance types: {e}")
         return []
 
+# Process-wide lookup table {instance_type: row}, loaded once
+_instance_type_catalog = None
+
+def get_instance_type_catalog(refresh=False):
+    """
+    Instance type specs as a dict keyed by instance_type.
+    Loaded from aws_instance_types once per process; refresh=True after a sync.
+    """
+    global _instance_type_catalog
+    if _instance_type_catalog is None or refresh:
+        rows = get_all_instance_types()
+        if rows or refresh:
+            _instance_type_catalog = {r['instance_type']: r for r in rows}
+        else:
+            return {}
+    return _instance_type_catalog
+
+def upsert_instance_types(rows):
+    """
+    Upsert synced specs (vcpu, memory_gb, arch) into aws_instance_types.
+    Keeps curated categories; new types get the provided/guessed category.
+    Returns: number of rows written.
+    """
+    client = get_supabase()
+    if not client: return 0
+    if not rows: return 0
+
+    existing = get_instance_type_catalog()
+    payload = []
+    for r in rows:
+        current = existing.get(r['instance_type'], {})
+        payload.append({
+            "instance_type": r['instance_type'],
+            "vcpu": r.get('vcpu'),
+            "memory_gb": r.get('memory_gb'),
+            "arch": r.get('arch') or 'x86_64',
+            "category": current.get('category') or r.get('category') or 'Other'
+        })
+
+    written = 0
+    try:
+        for n in range(0, len(payload), 500):
+            chunk = payload[n:n + 500]
+            client.table("aws_instance_types").upsert(chunk, on_conflict="instance_type").execute()
+            written += len(chunk)
+    except Exception as e:
+        print(f"Error upserting instance types: {e}")
+    get_instance_type_catalog(refresh=True)
+    return written
+
+def _build_instance_row(user_id, credential_id, instance_id, ip, region, project_name, status, encrypted_key, specs, key_pair_id=None):
+    """Build an 'instances' row. Project booleans are derived from project_name."""
+    # Parse initial project name to set booleans
+    p_name = project_name or "Pending"
+    
+    # Initialize booleans based on project_name input (for backward compatibility / initial install)
+    data = {
+        "user_id": user_id,
+        "credential_id": credential_id,
+        "instance_id": instance_id,
+        "ip_address": ip,
+        "region": region,
+        "project_name": p_name, # FIXED: Ensure project_name is provided (NOT NULL constraint)
+        "status": status,
+        "private_key": encrypted_key,
+        "key_pair_id": key_pair_id,
+        "proj_titan": "Titan" in p_name,
+        "proj_nexus": "Nexus" in p_name,
+        "proj_shardeum": "Shardeum" in p_name,
+        "proj_babylon": "Babylon" in p_name,
+        "proj_meson": "Meson" in p_name or "GagaNode" in p_name,
+        "proj_proxy": "Proxy" in p_name or "Dante" in p_name or "Squid" in p_name
+    }
+    
+    # Add specs if provided
+    if specs:
+        data.update({
+            "instance_type": specs.get("instance_type"),
+            "vcpu_count": specs.get("vcpu_count"),
+            "memory_gb": specs.get("memory_gb"),
+            "os_name": specs.get("os_name"),
+            "disk_info": specs.get("disk_info")
+        })
+    return data
+
 def log_instance(user_id, credential_id, instance_id, ip, region, project_name, status="active", private_key=None, specs=None):
     """
     Log instance details to Supabase 'instances' table with user_id association.
@@ -326,51 +533,44 @@ def log_instance(user_id, credential_id, instance_id, ip, region, project_name,
 
     encrypted_key = encrypt_key(private_key) if private_key else None
 
-    # Parse initial project name to set booleans
-    p_name = project_name or "Pending"
-    
-    # Initialize booleans based on project_name input (for backward compatibility / initial install)
-    is_titan = "Titan" in p_name
-    is_nexus = "Nexus" in p_name
-    is_shardeum = "Shardeum" in p_name
-    is_babylon = "Babylon" in p_name
-    is_meson = "Meson" in p_name or "GagaNode" in p_name
-    is_proxy = "Proxy" in p_name or "Dante" in p_name or "Squid" in p_name
-
     try:
-        data = {
-            "user_id": user_id,
-            "credential_id": credential_id,
-            "instance_id": instance_id,
-            "ip_address": ip,
-            "region": region,
-            "project_name": p_name, # FIXED: Ensure project_name is provided (NOT NULL constraint)
-            "status": status,
-            "private_key": encrypted_key,
-            "proj_titan": is_titan,
-            "proj_nexus": is_nexus,
-            "proj_shardeum": is_shardeum,
-            "proj_babylon": is_babylon,
-            "proj_meson": is_meson,
-            "proj_proxy": is_proxy
-        }
-        
-        # Add specs if provided
-        if specs:
-            data.update({
-                "instance_type": specs.get("instance_type"),
-                "vcpu_count": specs.get("vcpu_count"),
-                "memory_gb": specs.get("memory_gb"),
-                "os_name": specs.get("os_name"),
-                "disk_info": specs.get("disk_info")
-            })
-
+        data = _build_instance_row(user_id, credential_id, instance_id, ip, region, project_name, status, encrypted_key, specs)
         client.table("instances").insert(data).execute()
         print(f"Logged instance {instance_id} to database.")
     except Exception as e:
         print(f"Error logging to database: {e}")
         raise # Re-raise exception to trigger rollback in app.py
 
+def log_instances(user_id, credential_id, region, instances, project_name="Pending", status="active", private_key=None, specs=None, key_pair_id=None):
+    """
+    Bulk version of log_instance: one INSERT for a whole launch batch.
+    instances: list of {id, ip} (as returned by logic.launch_base_instances);
+    an optional per-instance 'specs' dict overrides the shared specs (fleet launches)
+    The shared private key is encrypted once; with key_pair_id the rows only
+    reference the registered account key and store no key material.
+    """
+    client = get_supabase()
+    if not client:
+        print("Supabase credentials not found. Skipping DB logging.")
+        return
+
+    if not instances:
+        return
+
+    encrypted_key = encrypt_key(private_key) if private_key else None
+
+    try:
+        rows = [
+            _build_instance_row(user_id, credential_id, inst['id'], inst.get('ip'), region, project_name, status, encrypted_key,
+                                {**(specs or {}), **inst['specs']} if inst.get('specs') else specs, key_pair_id)
+            for inst in instances
+        ]
+        client.table("instances").insert(rows).execute()
+        print(f"Logged {len(rows)} instances to database.")
+    except Exception as e:
+        print(f"Error logging to database: {e}")
+        raise # Re-raise exception to trigger rollback in app.py
+
 def get_user_instances(user_id):
     """
     Retrieve all instances associated with a specific User ID.
@@ -385,7 +585,7 @@ def get_user_instances(user_id):
         # Fetch instances and join with aws_credentials to get alias name if needed
         # Explicitly select columns to ensure we get the new booleans
         response = client.table("instances") \
-            .select("*, aws_credentials(alias_name, access_key_id)") \
+            .select("*, aws_credentials(alias_name, access_key_id), aws_key_pairs(private_key)") \
             .eq("user_id", user_id) \
             .order("created_at", desc=True) \
             .execute()
@@ -401,12 +601,12 @@ def get_instance_private_key(instance_id):
     if not client: return None
     try:
         response = client.table("instances") \
-            .select("private_key") \
+            .select("private_key, key_pair_id") \
             .eq("instance_id", instance_id) \
             .single() \
             .execute()
-        if response.data and response.data.get("private_key"):
-            return decrypt_key(response.data["private_key"])
+        if response.data:
+            return resolve_instance_key(response.data)
         return None
     except Exception as e:
         print(f"Error fetching private key: {e}")
@@ -429,6 +629,26 @@ def update_instance_status(instance_id, new_status):
     except Exception as e:
         print(f"Error updating instance status: {e}")
 
+def update_instance_launch_state(instance_id, status, ip=None, client=None):
+    """
+    Fill in status / public IP once a launched instance settles.
+    client: pass an explicit Supabase client when called from a background
+    thread (no Streamlit session there).
+    """
+    client = client or get_supabase()
+    if not client: return
+
+    try:
+        data = {"status": status}
+        if ip:
+            data["ip_address"] = ip
+        client.table("instances") \
+            .update(data) \
+            .eq("instance_id", instance_id) \
+            .execute()
+    except Exception as e:
+        print(f"Error updating launch state for {instance_id}: {e}")
+
 def update_instance_project(instance_id, project_name):
     """
     Update the project name of an instance in the database.
@@ -480,13 +700,41 @@ def update_instance_health(instance_id, health_status):
     except Exception as e:
         print(f"Error updating instance health: {e}")
 
-def update_instance_projects_status(instance_id, detected_projects):
+def update_instance_reachability(results, max_workers=10):
+    """
+    Store reachability sweep results.
+    results: {instance_id: {reachable, latency_ms, ports, checked_at}}
+    """
+    client = get_supabase()
+    if not client: return
+
+    def update(item):
+        instance_id, r = item
+        try:
+            client.table("instances") \
+                .update({
+                    "reachable": r["reachable"],
+                    "reach_latency_ms": r["latency_ms"],
+                    "reach_ports": r["ports"],
+                    "reach_checked_at": r["checked_at"]
+                }) \
+                .eq("instance_id", instance_id) \
+                .execute()
+        except Exception as e:
+            print(f"Error updating instance reachability: {e}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(update, results.items()))
+
+def update_instance_projects_status(instance_id, detected_projects, client=None):
     """
     Update the boolean project flags for an instance.
     detected_projects: List of strings (e.g. ['Titan', 'Nexus'])
     Only sets flags to TRUE if detected; does NOT unset existing flags to avoid overwriting.
+    client: pass an explicit Supabase client when called from a background
+    thread (no Streamlit session there).
     """
-    client = get_supabase()
+    client = client or get_supabase()
     if not client: return
     
     try:
@@ -513,11 +761,33 @@ def update_instance_projects_status(instance_id, detected_projects):
     except Exception as e:
         print(f"Error updating instance projects: {e}")
 
+SYNC_INSERT_BATCH = 200
+
+def _insert_instance_rows(client, rows, stats):
+    """Batch insert new instance rows, falling back to single inserts on error."""
+    try:
+        client.table("instances").insert(rows).execute()
+        stats["new"] += len(rows)
+    except Exception as e:
+        print(f"Error batch importing instances: {e}")
+        # Try fallback: Insert one by one to find the specific error or succeed partially
+        print("DEBUG: Retrying with single inserts...")
+        for item in rows:
+            try:
+                client.table("instances").insert(item).execute()
+                stats["new"] += 1
+            except Exception as inner_e:
+                print(f"Failed to insert instance {item['instance_id']}: {inner_e}")
+
 def sync_instances(user_id, credential_id, region, aws_instances):
     """
     Sync AWS instances with database records.
-    aws_instances: List of dicts from scan_all_instances
-    Optimized: Uses batch insert for new instances.
+    aws_instances: Iterable of dicts (list from scan_all_instances or the
+    logic.iter_instances generator). Consumed incrementally: new rows are
+    inserted in batches as they arrive, so memory stays bounded and DB writes
+    overlap with AWS pagination.
+    If the iterable raises mid-way, missing-instance cleanup is skipped so a
+    failed scan never wipes DB rows.
     """
     client = get_supabase()
     if not client: return {"new": 0, "updated": 0}
@@ -536,69 +806,65 @@ def sync_instances(user_id, credential_id, region, aws_instances):
         print(f"Sync DB fetch error: {e}")
         return stats
 
-    aws_map = {i['instance_id']: i for i in aws_instances}
-    
+    seen_ids = set()
     new_instances_data = []
 
-    # 2. Process AWS instances (Collect New & Update Existing)
-    for aws_id, aws_info in aws_map.items():
-        aws_status = aws_info['status']
-        
-        if aws_id not in db_map:
-            # Found NEW instance - Add to batch list
-            if aws_status != 'terminated': # Don't import terminated instances
-                # Initialize booleans (default False)
-                # For newly discovered instances via sync, we don't know the project yet unless we probe.
-                # So we leave them False.
-                new_instances_data.append({
-                    "user_id": user_id,
-                    "credential_id": credential_id,
-                    "instance_id": aws_id,
-                    "ip_address": aws_info['ip_address'],
-                    "region": region,
-                    "project_name": aws_info.get('project_name') or "Pending", # Re-enabled with fallback
-                    "status": aws_status,
-                    "proj_titan": False,
-                    "proj_nexus": False,
-                    "proj_shardeum": False,
-                    "proj_babylon": False,
-                    "proj_meson": False,
-                    "proj_proxy": False
-                })
-        
-        elif aws_status == 'terminated':
-            # Always delete terminated instances from DB, even if status didn't change
-            delete_instance(aws_id)
-            stats["updated"] += 1
+    # 2. Process AWS instances as they stream in (Collect New & Update Existing)
+    try:
+        for aws_info in aws_instances:
+            aws_id = aws_info['instance_id']
+            if aws_id in seen_ids:
+                continue
+            seen_ids.add(aws_id)
+            aws_status = aws_info['status']
+            
+            if aws_id not in db_map:
+                # Found NEW instance - Add to batch list
+                if aws_status != 'terminated': # Don't import terminated instances
+                    # For newly discovered instances via sync, we don't know the project yet unless we probe.
+                    # So we leave the booleans False.
+                    new_instances_data.append({
+                        "user_id": user_id,
+                        "credential_id": credential_id,
+                        "instance_id": aws_id,
+                        "ip_address": aws_info['ip_address'],
+                        "region": region,
+                        "project_name": aws_info.get('project_name') or "Pending", # Re-enabled with fallback
+                        "status": aws_status,
+                        "proj_titan": False,
+                        "proj_nexus": False,
+                        "proj_shardeum": False,
+                        "proj_babylon": False,
+                        "proj_meson": False,
+                        "proj_proxy": False
+                    })
+                    # 3. Flush inserts per batch instead of at the end
+                    if len(new_instances_data) >= SYNC_INSERT_BATCH:
+                        _insert_instance_rows(client, new_instances_data, stats)
+                        new_instances_data = []
             
-        elif db_map[aws_id] != aws_status:
-            # Status changed (and not terminated)
-            update_instance_status(aws_id, aws_status)
-            stats["updated"] += 1
+            elif aws_status == 'terminated':
+                # Always delete terminated instances from DB, even if status didn't change
+                delete_instance(aws_id)
+                stats["updated"] += 1
+                
+            elif db_map[aws_id] != aws_status:
+                # Status changed (and not terminated)
+                update_instance_status(aws_id, aws_status)
+                stats["updated"] += 1
+    except Exception as e:
+        print(f"Sync aborted while reading AWS instances ({region}): {e}")
+        if new_instances_data:
+            _insert_instance_rows(client, new_instances_data, stats)
+        stats["error"] = str(e)
+        return stats
 
-    # 3. Batch Insert New Instances
     if new_instances_data:
-        try:
-            print(f"DEBUG: Attempting to batch insert {len(new_instances_data)} instances...")
-            client.table("instances").insert(new_instances_data).execute()
-            stats["new"] += len(new_instances_data)
-            print("DEBUG: Batch insert successful.")
-        except Exception as e:
-            print(f"Error batch importing instances: {e}")
-            # Try fallback: Insert one by one to find the specific error or succeed partially
-            print("DEBUG: Retrying with single inserts...")
-            for item in new_instances_data:
-                try:
-                    client.table("instances").insert(item).execute()
-                    stats["new"] += 1
-                except Exception as inner_e:
-                    print(f"Failed to insert instance {item['instance_id']}: {inner_e}")
-
-    # 4. Process Missing instances (Mark as Terminated -> Delete)
-    for db_id, db_status in db_map.items():
-        if db_id not in aws_map:
-            # If missing from AWS, delete it (it's gone)
-            delete_instance(db_id)
-            stats["updated"] += 1
+        _insert_instance_rows(client, new_instances_data, stats)
+
+    # 4. Process Missing instances (gone from AWS -> Delete in chunked round trips)
+    missing_ids = [db_id for db_id in db_map if db_id not in seen_ids]
+    if missing_ids:
+        stats["updated"] += delete_instances(missing_ids, credential_id=credential_id, client=client)
             
     return stats
@@ -0,0 +1,59 @@
+import os
+from aws_cache import TTLCache
+from logic import check_account_health, check_ec2_access, get_vcpu_quota, has_running_instances, invalidate_account_health
+from db import get_credential_vcpu_usage, update_credential_status
+
+# Full reports (status + quota + usage) are reused this long per credential
+HEALTH_REPORT_TTL = int(os.environ.get("DEPIN_HEALTH_REPORT_TTL", 1800))
+
+# credential id -> {status, msg, limit, used, probe_status}
+_reports = TTLCache(HEALTH_REPORT_TTL)
+
+
+def check_credential(cred, region, force=False):
+    """
+    Health + quota report for one credential.
+    The identity probe is memoized (logic.HEALTH_PROBE_TTL); EC2 access, quota
+    and usage are only re-checked when the probed status differs from the last
+    report or the report expired. force=True bypasses every cache (single 🩺 check).
+    Returns: {status, msg, limit, used, cached}
+    """
+    ak, sk = cred['access_key_id'], cred['secret_access_key']
+    proxy_url = cred.get('proxy_url')
+
+    res = check_account_health(ak, sk, proxy_url=proxy_url, refresh=force)
+    report = None if force else _reports.get(cred['id'])
+    if report and report['probe_status'] == res['status']:
+        return {**{k: v for k, v in report.items() if k != 'probe_status'}, 'cached': True}
+
+    status, msg = res['status'], res['msg']
+    if status == 'active':
+        # STS succeeds for unverified (OptInRequired) and blocked accounts; EC2 doesn't
+        ec2 = check_ec2_access(ak, sk, region, proxy_url=proxy_url)
+        if ec2:
+            status, msg = ec2['status'], ec2['msg']
+
+    limit = None
+    used = None
+    if status == 'active':
+        # 1. Get Limit (cached per account/region in logic)
+        limit = get_vcpu_quota(ak, sk, region, proxy_url=proxy_url, refresh=force)
+
+        # 2. Get Usage (DB First)
+        db_used = get_credential_vcpu_usage(cred['id'])
+        if db_used > 0:
+            used = db_used
+        else:
+            # DB says 0, double check AWS lightly (-1 = unknown to DB)
+            used = -1 if has_running_instances(ak, sk, region, proxy_url=proxy_url) else 0
+
+    update_credential_status(cred['id'], status, limit=limit, used=used)
+    report = {'status': status, 'msg': msg, 'limit': limit, 'used': used}
+    # Keyed on the STS result so a cached EC2 verdict isn't re-checked every time
+    _reports.set(cred['id'], {**report, 'probe_status': res['status']})
+    return {**report, 'cached': False}
+
+def forget_credential(cred):
+    """Drop cached health of a credential (edited/deleted)."""
+    _reports.invalidate(cred['id'])
+    invalidate_account_health(cred['access_key_id'])
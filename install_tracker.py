@@ -0,0 +1,144 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from monitor import poll_install_job
+from db import update_instance_projects_status
+
+# Seconds between polls of running installs
+POLL_INTERVAL = 15
+# Hosts polled at the same time (each poll is one short exec on a pooled connection)
+POLL_WORKERS = 32
+# Give up on an install that is still running (or unreachable) after this long
+INSTALL_TIMEOUT = 3600
+# Finished jobs are kept this long so the UI can still read their progress
+JOB_RETENTION = 3600
+# Host states that will not change any more
+FINAL_STATES = ('succeeded', 'failed', 'lost', 'timeout')
+
+
+class InstallTracker:
+    """
+    Background poller for installers started detached with
+    monitor.start_install_job. Every running host is polled once per round
+    for its exit status and log tail; on success the project is written to
+    the instance row. Job state lives in the process, so the UI can pick it
+    up again after a rerun.
+    """
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._jobs = {}     # job_id -> {created, finished, hosts: {instance_id: {ip, state, msg, tail}}}
+        self._running = {}  # instance_id -> {job_id, ip, private_key, remote_job_id, db_key, client, started}
+        self._thread = None
+
+    def new_job(self):
+        """Create a job id grouping the hosts of one batch install."""
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._jobs[job_id] = {"created": time.time(), "finished": None, "hosts": {}}
+        return job_id
+
+    def track(self, job_id, instance_id, ip, private_key, remote_job_id, db_key=None, db_client=None):
+        """
+        Register a started installer for background polling.
+        db_client: the caller's Supabase client; the poller thread has no
+        Streamlit session, so get_supabase() there would be anonymous.
+        """
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {"created": time.time(), "finished": None, "hosts": {}})
+            job["finished"] = None
+            job["hosts"][instance_id] = {"ip": ip, "state": "running", "msg": "Started", "tail": ""}
+            self._running[instance_id] = {
+                "job_id": job_id,
+                "ip": ip,
+                "private_key": private_key,
+                "remote_job_id": remote_job_id,
+                "db_key": db_key,
+                "client": db_client,
+                "started": time.time()
+            }
+            self._ensure_thread()
+
+    def mark_failed(self, job_id, instance_id, ip, msg):
+        """Record a host whose installer could not be started."""
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {"created": time.time(), "finished": None, "hosts": {}})
+            job["hosts"][instance_id] = {"ip": ip, "state": "failed", "msg": msg, "tail": ""}
+            self._update_finished_locked(job)
+
+    def progress(self, job_id):
+        """
+        Returns: {total, running, succeeded, failed, done, hosts} or None.
+        done is True once no host of the job is still running.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            hosts = {i_id: dict(h) for i_id, h in job["hosts"].items()}
+        running = sum(1 for h in hosts.values() if h["state"] == "running")
+        succeeded = sum(1 for h in hosts.values() if h["state"] == "succeeded")
+        return {
+            "total": len(hosts),
+            "running": running,
+            "succeeded": succeeded,
+            "failed": len(hosts) - running - succeeded,
+            "done": running == 0,
+            "hosts": hosts
+        }
+
+    def _ensure_thread(self):
+        # Caller holds the lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="install-tracker", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._running:
+                    self._thread = None
+                    return
+                running = list(self._running.items())
+            with ThreadPoolExecutor(max_workers=max(1, min(POLL_WORKERS, len(running)))) as executor:
+                list(executor.map(lambda item: self._poll(*item), running))
+            self._expire_jobs()
+
+    def _poll(self, instance_id, r):
+        res = poll_install_job(r["ip"], r["private_key"], r["remote_job_id"])
+        state = res["state"]
+
+        if state == "succeeded" and r["db_key"]:
+            update_instance_projects_status(instance_id, [r["db_key"]], client=r["client"])
+        if state == "error":
+            # Unreachable for now; keep polling until the timeout
+            state = "timeout" if time.time() - r["started"] > INSTALL_TIMEOUT else "running"
+        elif state == "running" and time.time() - r["started"] > INSTALL_TIMEOUT:
+            state = "timeout"
+
+        with self._lock:
+            job = self._jobs.get(r["job_id"])
+            if job and instance_id in job["hosts"]:
+                job["hosts"][instance_id].update(state=state, msg=res["msg"], tail=res["tail"] or job["hosts"][instance_id]["tail"])
+            if state in FINAL_STATES:
+                self._running.pop(instance_id, None)
+                if job:
+                    self._update_finished_locked(job)
+
+    @staticmethod
+    def _update_finished_locked(job):
+        if all(h["state"] in FINAL_STATES for h in job["hosts"].values()):
+            job["finished"] = time.time()
+
+    def _expire_jobs(self):
+        now = time.time()
+        with self._lock:
+            for job_id in [j for j, v in self._jobs.items() if v["finished"] and now - v["finished"] > JOB_RETENTION]:
+                del self._jobs[job_id]
+
+
+# Shared tracker for the whole process (survives Streamlit reruns)
+tracker = InstallTracker()
@@ -0,0 +1,121 @@
+import threading
+import uuid
+from botocore.exceptions import ClientError
+from logic import generate_ssh_key_pair, public_key_from_private, import_key_pair, delete_key_pair
+from db import get_key_pair, save_key_pair, get_key_pair_private_key, forget_key_pair_material
+
+# AWS error codes meaning the registered key is gone from the account/region
+MISSING_KEY_CODES = ('InvalidKeyPair.NotFound',)
+
+
+class KeyRegistry:
+    """
+    One imported SSH key pair per (credential, region), reused by every launch.
+    Launches no longer create (and store) a fresh key each time; instances
+    reference the shared row in 'aws_key_pairs' through key_pair_id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}  # (credential_id, region) -> Lock
+        self._rows = {}   # (credential_id, region) -> {id, key_name, fingerprint}
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = threading.Lock()
+                self._locks[key] = lock
+            return lock
+
+    def ensure(self, user_id, cred, region):
+        """
+        Registered key pair for (cred, region), importing a new one on first use.
+        Returns: {id, key_name, fingerprint}. Raises on AWS/DB errors.
+        """
+        key = (cred['id'], region)
+        with self._key_lock(key):
+            row = self._rows.get(key)
+            if row:
+                return row
+
+            row = get_key_pair(cred['id'], region)
+            if not row:
+                row = self._create(user_id, cred, region)
+            self._rows[key] = row
+            return row
+
+    def _create(self, user_id, cred, region):
+        private_pem, public_key = generate_ssh_key_pair()
+        key_name = f"depin-{uuid.uuid4().hex[:12]}"
+        fingerprint = import_key_pair(
+            cred['access_key_id'], cred['secret_access_key'], region,
+            key_name, public_key, proxy_url=cred.get('proxy_url')
+        )
+        try:
+            row = save_key_pair(user_id, cred['id'], region, key_name, private_pem, fingerprint)
+        except Exception:
+            # Not stored (DB error, or another process registered this
+            # (credential, region) first): nothing will ever use the imported key
+            self._discard(cred, region, key_name)
+            row = get_key_pair(cred['id'], region)
+            if not row:
+                raise
+        return {"id": row['id'], "key_name": row['key_name'], "fingerprint": row.get('fingerprint')}
+
+    @staticmethod
+    def _discard(cred, region, key_name):
+        try:
+            delete_key_pair(
+                cred['access_key_id'], cred['secret_access_key'], region,
+                key_name, proxy_url=cred.get('proxy_url')
+            )
+        except Exception as e:
+            print(f"Failed to delete unused key pair {key_name} ({region}): {e}")
+
+    def repair(self, user_id, cred, region):
+        """
+        Re-import the stored public key after it was deleted on the AWS side
+        (InvalidKeyPair.NotFound). Instances already using the key keep working.
+        """
+        key = (cred['id'], region)
+        with self._key_lock(key):
+            self._rows.pop(key, None)
+            row = get_key_pair(cred['id'], region)
+            private_pem = get_key_pair_private_key(row['id']) if row else None
+            if not private_pem:
+                row = self._create(user_id, cred, region)
+            else:
+                try:
+                    import_key_pair(
+                        cred['access_key_id'], cred['secret_access_key'], region,
+                        row['key_name'], public_key_from_private(private_pem),
+                        proxy_url=cred.get('proxy_url')
+                    )
+                except ClientError as e:
+                    # Already back (repaired concurrently) is fine
+                    if e.response['Error']['Code'] != 'InvalidKeyPair.Duplicate':
+                        raise
+            self._rows[key] = row
+            return row
+
+    def forget(self, credential_id):
+        """Drop cached rows and key material of a credential (deleted/edited)."""
+        with self._lock:
+            for k in [k for k in self._rows if k[0] == credential_id]:
+                del self._rows[k]
+        forget_key_pair_material(credential_id)
+
+
+# Shared registry for the whole process
+registry = KeyRegistry()
+
+def ensure_key_pair(user_id, cred, region):
+    return registry.ensure(user_id, cred, region)
+
+def repair_key_pair(user_id, cred, region):
+    return registry.repair(user_id, cred, region)
+
+def is_missing_key_error(msg):
+    """launch_base_instances reports errors as text; detect a vanished key pair."""
+    return any(code in (msg or '') for code in MISSING_KEY_CODES)
@@ -0,0 +1,146 @@
+import threading
+import time
+import uuid
+from logic import describe_launch_state
+from db import update_instance_launch_state
+
+# Seconds between polls of pending instances
+POLL_INTERVAL = 10
+# Give up on an instance that hasn't reached 'running' after this long
+LAUNCH_TIMEOUT = 900
+# Finished jobs are kept this long so the UI can still read their progress
+JOB_RETENTION = 3600
+# States that will never turn into 'running'
+FAILED_STATES = ('shutting-down', 'terminated', 'stopping', 'stopped')
+
+
+class LaunchTracker:
+    """
+    Background poller for launches started with wait=False.
+    Pending instances from every account are grouped per (credential, region)
+    and resolved with one chunked describe per group each poll. Once an
+    instance is running its public IP and status are written to 'instances'.
+    """
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._jobs = {}     # job_id -> {created, finished, instances: {id: state}}
+        self._pending = {}  # instance_id -> {job_id, ak, sk, region, proxy_url, client, started}
+        self._thread = None
+
+    def new_job(self):
+        """Create a job id grouping several accounts of one batch deploy."""
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._jobs[job_id] = {"created": time.time(), "finished": None, "instances": {}}
+        return job_id
+
+    def track(self, job_id, ak, sk, region, instance_ids, proxy_url=None, db_client=None):
+        """Register launched instances for background state tracking."""
+        now = time.time()
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {"created": now, "finished": None, "instances": {}})
+            job["finished"] = None
+            for i_id in instance_ids:
+                job["instances"][i_id] = "pending"
+                self._pending[i_id] = {
+                    "job_id": job_id,
+                    "ak": ak,
+                    "sk": sk,
+                    "region": region,
+                    "proxy_url": proxy_url,
+                    "client": db_client,
+                    "started": now
+                }
+            self._ensure_thread()
+
+    def progress(self, job_id):
+        """
+        Returns: {total, running, pending, failed, done, instances} or None.
+        done is True once no instance of the job is still pending.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            states = dict(job["instances"])
+        running = sum(1 for s in states.values() if s == "running")
+        pending = sum(1 for s in states.values() if s == "pending")
+        return {
+            "total": len(states),
+            "running": running,
+            "pending": pending,
+            "failed": len(states) - running - pending,
+            "done": pending == 0,
+            "instances": states
+        }
+
+    def _ensure_thread(self):
+        # Caller holds the lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="launch-tracker", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+                groups = {}
+                for i_id, p in self._pending.items():
+                    key = (p["ak"], p["sk"], p["region"], p["proxy_url"])
+                    groups.setdefault(key, []).append(i_id)
+            for (ak, sk, region, proxy_url), ids in groups.items():
+                self._poll_group(ak, sk, region, proxy_url, ids)
+            self._expire_jobs()
+
+    def _poll_group(self, ak, sk, region, proxy_url, ids):
+        try:
+            states = describe_launch_state(ak, sk, region, ids, proxy_url=proxy_url)
+        except Exception as e:
+            # Throttling / network errors; retry next round
+            print(f"Launch tracker poll failed ({region}): {e}")
+            states = {}
+
+        now = time.time()
+        for i_id in ids:
+            with self._lock:
+                p = self._pending.get(i_id)
+            if not p:
+                continue
+            info = states.get(i_id)
+            status = info["status"] if info else None
+
+            if status == "running" and info["ip"]:
+                update_instance_launch_state(i_id, "running", info["ip"], client=p["client"])
+                self._finish(i_id, "running")
+            elif status in FAILED_STATES:
+                update_instance_launch_state(i_id, status, client=p["client"])
+                self._finish(i_id, status)
+            elif now - p["started"] > LAUNCH_TIMEOUT:
+                update_instance_launch_state(i_id, "timeout", client=p["client"])
+                self._finish(i_id, "timeout")
+
+    def _finish(self, instance_id, state):
+        with self._lock:
+            p = self._pending.pop(instance_id, None)
+            if not p:
+                return
+            job = self._jobs.get(p["job_id"])
+            if job:
+                job["instances"][instance_id] = state
+                if all(s != "pending" for s in job["instances"].values()):
+                    job["finished"] = time.time()
+
+    def _expire_jobs(self):
+        now = time.time()
+        with self._lock:
+            for job_id in [j for j, v in self._jobs.items() if v["finished"] and now - v["finished"] > JOB_RETENTION]:
+                del self._jobs[job_id]
+
+
+# Shared tracker for the whole process (survives Streamlit reruns)
+tracker = LaunchTracker()
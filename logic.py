@@ -1,8 +1,16 @@
-import boto3
+import os
 import time
 import datetime
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from botocore.exceptions import ClientError
-from botocore.config import Config
+import threading
+import hashlib
+import base64
+import json
+from contextlib import contextmanager
+from aws_pool import get_client, is_throttling_error
+from aws_cache import TTLCache, PersistentTTLCache
 
 # Amazon Linux 2023 AMI IDs (x86_64)
 AMI_MAPPING = {
@@ -20,15 +28,168 @@ AMI_MAPPING_UBUNTU = {
     'ap-northeast-1': 'ami-0270a6a090e4a3225'
 }
 
-def get_vcpu_quota(ak, sk, region, proxy_url=None):
+# --- Region Discovery ---
+# Enabled regions per credential change only when the account opts in/out.
+REGION_CACHE_TTL = 6 * 3600
+# Max concurrent regional calls per account during fan-out scans
+ACCOUNT_SCAN_CONCURRENCY = 4
+
+_region_cache = TTLCache(REGION_CACHE_TTL)
+_account_slots = {}
+_account_slots_lock = threading.Lock()
+
+def get_enabled_regions(ak, sk, proxy_url=None, refresh=False):
+    """
+    List regions usable by this credential (opted-in or opt-in-not-required).
+    Cached per access key; falls back to the built-in AMI regions on error.
+    Returns: sorted list of region names.
+    """
+    if not refresh:
+        cached = _region_cache.get(ak)
+        if cached is not None:
+            return cached
+
+    try:
+        ec2 = get_client(ak, sk, 'us-east-1', 'ec2', proxy_url=proxy_url)
+        response = ec2.describe_regions(
+            AllRegions=True,
+            Filters=[{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}]
+        )
+        regions = sorted(r['RegionName'] for r in response.get('Regions', []))
+        if regions:
+            _region_cache.set(ak, regions)
+            return regions
+    except Exception as e:
+        print(f"Region discovery failed: {e}")
+    # Not cached, so the next call retries discovery
+    return sorted(AMI_MAPPING.keys())
+
+@contextmanager
+def account_slot(ak, limit=ACCOUNT_SCAN_CONCURRENCY):
+    """Bound concurrent regional calls per account to avoid throttling."""
+    with _account_slots_lock:
+        sem = _account_slots.get(ak)
+        if sem is None:
+            sem = threading.BoundedSemaphore(limit)
+            _account_slots[ak] = sem
+    with sem:
+        yield
+
+def plan_region_scan(creds, max_workers=20):
+    """
+    Build (cred, region) scan tasks over every enabled region.
+    Tasks are interleaved round-robin across accounts so a worker pool
+    spreads load instead of hammering one account at a time.
+    """
+    def discover(cred):
+        regions = get_enabled_regions(cred['access_key_id'], cred['secret_access_key'], proxy_url=cred.get('proxy_url'))
+        return [(cred, r) for r in regions]
+
+    if not creds:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        per_account = list(executor.map(discover, creds))
+
+    tasks = []
+    depth = max((len(t) for t in per_account), default=0)
+    for n in range(depth):
+        for account_tasks in per_account:
+            if n < len(account_tasks):
+                tasks.append(account_tasks[n])
+    return tasks
+
+# --- Instance Type Catalog ---
+# One in-memory lookup table {instance_type: {vcpu, memory_gb, arch, category}},
+# loaded once per process from aws_instance_types (see db.get_instance_type_catalog).
+_type_catalog = {}
+_type_catalog_lock = threading.Lock()
+
+# Family prefix -> category, used for types synced from AWS without a curated category
+TYPE_CATEGORY_PREFIXES = [
+    (('t', 'm', 'mac', 'a1'), 'General Purpose'),
+    (('c',), 'Compute Optimized'),
+    (('r', 'x', 'z', 'u-'), 'Memory Optimized'),
+    (('i', 'd', 'h', 'im', 'is'), 'Storage Optimized'),
+    (('p', 'g', 'f', 'inf', 'trn', 'dl', 'vt'), 'Accelerated Computing'),
+    (('hpc',), 'HPC Optimized'),
+]
+
+def set_instance_type_catalog(catalog):
+    """Install the process-wide type lookup table."""
+    global _type_catalog
+    with _type_catalog_lock:
+        _type_catalog = dict(catalog or {})
+
+def get_instance_spec(instance_type):
+    """Catalog entry for a type or None."""
+    return _type_catalog.get(instance_type)
+
+def get_type_vcpus(instance_type):
+    """vCPUs for a type from the catalog; size-name heuristic only if unknown."""
+    spec = _type_catalog.get(instance_type)
+    if spec and spec.get('vcpu'):
+        return int(spec['vcpu'])
+    # Fallback heuristic
+    itype = instance_type or 't2.micro'
+    if 'xlarge' in itype: return 4
+    elif 'large' in itype: return 2
+    elif 'medium' in itype: return 2
+    return 1
+
+def guess_type_category(instance_type):
+    family = instance_type.split('.')[0]
+    # Longest prefixes first so 'inf' wins over 'i', 'hpc' over 'h'
+    candidates = sorted(((p, cat) for prefixes, cat in TYPE_CATEGORY_PREFIXES for p in prefixes), key=lambda x: -len(x[0]))
+    for prefix, cat in candidates:
+        if family.startswith(prefix):
+            return cat
+    return 'Other'
+
+def fetch_instance_types(ak, sk, region, proxy_url=None):
+    """
+    Page through describe_instance_types for one region.
+    Returns: list of {instance_type, vcpu, memory_gb, arch}. Raises on AWS errors.
+    """
+    ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    paginator = ec2.get_paginator('describe_instance_types')
+    rows = []
+    for page in paginator.paginate(PaginationConfig={'PageSize': 100}):
+        for t in page.get('InstanceTypes', []):
+            archs = t.get('ProcessorInfo', {}).get('SupportedArchitectures', [])
+            rows.append({
+                'instance_type': t['InstanceType'],
+                'vcpu': t.get('VCpuInfo', {}).get('DefaultVCpus'),
+                'memory_gb': round(t.get('MemoryInfo', {}).get('SizeInMiB', 0) / 1024, 2),
+                'arch': 'arm64' if 'arm64' in archs else 'x86_64'
+            })
+    return rows
+
+# --- Capacity Service ---
+# Quotas change rarely: cache them for hours. Usage is kept as a running figure
+# adjusted by our own launches/terminations and reconciled against AWS periodically.
+QUOTA_CACHE_TTL = 6 * 3600
+QUOTA_FALLBACK_TTL = 600
+DEFAULT_VCPU_QUOTA = 32
+USAGE_RECONCILE_INTERVAL = 900
+
+_quota_cache = TTLCache(QUOTA_CACHE_TTL)
+_usage_lock = threading.Lock()
+_usage = {}  # (ak, region) -> {"used": int, "reconciled_at": float}
+
+def get_vcpu_quota(ak, sk, region, proxy_url=None, refresh=False):
     """
     Get the vCPU quota for 'Running On-Demand Standard (A, C, D, H, I, M, R, T, Z) instances'.
+    Cached per (account, region) for QUOTA_CACHE_TTL.
     Returns: limit (int)
     """
-    config = Config(proxies={'https': proxy_url, 'http': proxy_url}) if proxy_url else None
+    key = (ak, region)
+    if not refresh:
+        cached = _quota_cache.get(key)
+        if cached is not None:
+            return cached
+
     try:
-        session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region)
-        client = session.client('service-quotas', config=config)
+        client = get_client(ak, sk, region, 'service-quotas', proxy_url=proxy_url)
         
         # Quota Code for Running On-Demand Standard instances
         quota_code = 'L-1216C47A' 
@@ -36,67 +197,84 @@ def get_vcpu_quota(ak, sk, region, proxy_url=None):
         
         response = client.get_service_quota(ServiceCode=service_code, QuotaCode=quota_code)
         limit = int(response['Quota']['Value'])
+        _quota_cache.set(key, limit)
         return limit
     except Exception as e:
-        # Fallback or error handling
-        # print(f"Quota check failed: {e}")
-        # Try legacy method if service-quotas fails (e.g. permission issue)
-        try:
-            session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region)
-            ec2 = session.client('ec2', config=config)
-            # This attribute is often not accurate for vCPU limits but better than nothing
-            # Actually, better to default to a safe value like 32 if we can't read it
-            return 32 
-        except:
-            return 0
+        # Throttling is not "no permission": let the caller retry later
+        if is_throttling_error(e):
+            raise
+        # If service-quotas fails (e.g. permission issue), default to a safe value.
+        # Cached briefly so a missing permission doesn't cost a call per launch.
+        _quota_cache.set(key, DEFAULT_VCPU_QUOTA, ttl=QUOTA_FALLBACK_TTL)
+        return DEFAULT_VCPU_QUOTA
+
+def _instance_vcpus(i):
+    """vCPUs of a described instance: CpuOptions (CoreCount * ThreadsPerCore) or the type catalog."""
+    if 'CpuOptions' in i:
+        core_count = i['CpuOptions'].get('CoreCount', 1)
+        threads_per_core = i['CpuOptions'].get('ThreadsPerCore', 1)
+        return core_count * threads_per_core
+    return get_type_vcpus(i.get('InstanceType', 't2.micro'))
+
+def _fetch_current_usage(ak, sk, region, proxy_url=None):
+    """Sum vCPUs of running/pending instances across all pages. Raises on error."""
+    ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    paginator = ec2.get_paginator('describe_instances')
+    total_vcpus = 0
+    for page in paginator.paginate(Filters=[{'Name': 'instance-state-name', 'Values': ['running', 'pending']}]):
+        for r in page['Reservations']:
+            for i in r['Instances']:
+                total_vcpus += _instance_vcpus(i)
+    return total_vcpus
 
-def get_current_usage(ak, sk, region, proxy_url=None):
+def get_current_usage(ak, sk, region, proxy_url=None, refresh=False):
     """
-    Count current vCPU usage by summing up vCPUs of all running instances.
+    Current vCPU usage for (account, region).
+    Served from the running figure; reconciled with AWS every USAGE_RECONCILE_INTERVAL.
     Returns: usage (int)
     """
-    config = Config(proxies={'https': proxy_url, 'http': proxy_url}) if proxy_url else None
+    key = (ak, region)
+    now = time.time()
+    with _usage_lock:
+        entry = _usage.get(key)
+        if entry and not refresh and now - entry["reconciled_at"] < USAGE_RECONCILE_INTERVAL:
+            return max(0, entry["used"])
+
     try:
-        session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region)
-        ec2 = session.client('ec2', config=config)
-        
-        response = ec2.describe_instances(
-            Filters=[{'Name': 'instance-state-name', 'Values': ['running', 'pending']}]
-        )
-        
-        total_vcpus = 0
-        for r in response['Reservations']:
-            for i in r['Instances']:
-                # Calculate vCPU based on CpuOptions (CoreCount * ThreadsPerCore)
-                # or fallback to safe defaults for known types if missing
-                vcpus = 1
-                if 'CpuOptions' in i:
-                    core_count = i['CpuOptions'].get('CoreCount', 1)
-                    threads_per_core = i['CpuOptions'].get('ThreadsPerCore', 1)
-                    vcpus = core_count * threads_per_core
-                else:
-                    # Fallback heuristic
-                    itype = i.get('InstanceType', 't2.micro')
-                    if 'xlarge' in itype: vcpus = 4
-                    elif 'large' in itype: vcpus = 2
-                    elif 'medium' in itype: vcpus = 2
-                    else: vcpus = 1
-                
-                total_vcpus += vcpus
-                
-        return total_vcpus
-    except Exception:
+        used = _fetch_current_usage(ak, sk, region, proxy_url)
+    except Exception as e:
+        # Keep serving the last known figure rather than reporting 0
+        if entry:
+            return max(0, entry["used"])
+        if is_throttling_error(e):
+            raise
         return 0
 
+    with _usage_lock:
+        _usage[key] = {"used": used, "reconciled_at": now}
+    return used
+
+def record_usage_delta(ak, region, vcpus):
+    """Adjust the running usage figure after our own launch (+) or termination (-)."""
+    with _usage_lock:
+        entry = _usage.get((ak, region))
+        if entry:
+            entry["used"] = max(0, entry["used"] + vcpus)
+
+def mark_usage_stale(ak, region):
+    """Force the next usage read to reconcile with AWS (e.g. terminated vCPUs unknown)."""
+    with _usage_lock:
+        entry = _usage.get((ak, region))
+        if entry:
+            entry["reconciled_at"] = 0
+
 def has_running_instances(ak, sk, region, proxy_url=None):
     """
     Lightweight check if any instances are running/pending.
     Returns: True if any instance found, False otherwise.
     """
-    config = Config(proxies={'https': proxy_url, 'http': proxy_url}) if proxy_url else None
     try:
-        session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region)
-        ec2 = session.client('ec2', config=config)
+        ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
         
         # MaxResults=5 is enough to detect existence
         response = ec2.describe_instances(
@@ -109,12 +287,15 @@ def has_running_instances(ak, sk, region, proxy_url=None):
                 return True
                 
         return False
-    except Exception:
+    except Exception as e:
+        if is_throttling_error(e):
+            raise
         return False
 
 def check_capacity(ak, sk, region, proxy_url=None):
     """
     Check available capacity for new instances.
+    Served from the quota cache and running usage figure (no AWS call when warm).
     Returns: {limit, used, available}
     """
     limit = get_vcpu_quota(ak, sk, region, proxy_url)
@@ -127,6 +308,32 @@ def check_capacity(ak, sk, region, proxy_url=None):
         "available": max(0, available)
     }
 
+# TCP ingress of the launcher security group: (from_port, to_port, project key)
+# project key None = opened for every instance
+SECURITY_GROUP_PORTS = [
+    (22, 22, None),
+    (80, 80, None),
+    (443, 443, None),
+    # Shardeum Ports
+    (8080, 8080, 'Shardeum'),
+    (9001, 9001, 'Shardeum'),
+    (10001, 10001, 'Shardeum'),
+    # Babylon Ports
+    (26656, 26657, 'Babylon'),
+    # SOCKS5 Proxy
+    (1080, 1080, 'Proxy'),
+    # Squid HTTP Proxy
+    (3128, 3128, 'Proxy'),
+]
+
+def get_project_ports(project_keys):
+    """SSH plus the security group ports of the given projects (e.g. ['Shardeum'])."""
+    ports = {22}
+    for lo, hi, project in SECURITY_GROUP_PORTS:
+        if project and project in project_keys:
+            ports.update(range(lo, hi + 1))
+    return sorted(ports)
+
 def ensure_security_group(ec2_client):
     """
     Ensure a security group 'DePIN-Launcher-SG' exists and allows SSH.
@@ -146,19 +353,8 @@ def ensure_security_group(ec2_client):
                 ec2_client.authorize_security_group_ingress(
                     GroupId=sg_id,
                     IpPermissions=[
-                        {'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                        {'IpProtocol': 'tcp', 'FromPort': 80, 'ToPort': 80, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                        {'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                        # Shardeum Ports
-                        {'IpProtocol': 'tcp', 'FromPort': 8080, 'ToPort': 8080, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                        {'IpProtocol': 'tcp', 'FromPort': 9001, 'ToPort': 9001, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                        {'IpProtocol': 'tcp', 'FromPort': 10001, 'ToPort': 10001, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                        # Babylon Ports
-                        {'IpProtocol': 'tcp', 'FromPort': 26656, 'ToPort': 26657, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                        # SOCKS5 Proxy
-                        {'IpProtocol': 'tcp', 'FromPort': 1080, 'ToPort': 1080, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                        # Squid HTTP Proxy
-                        {'IpProtocol': 'tcp', 'FromPort': 3128, 'ToPort': 3128, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}
+                        {'IpProtocol': 'tcp', 'FromPort': lo, 'ToPort': hi, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}
+                        for lo, hi, _ in SECURITY_GROUP_PORTS
                     ]
                 )
                 return sg_id
@@ -167,72 +363,192 @@ def ensure_security_group(ec2_client):
                 return None
         return None
 
-def launch_base_instance(ak, sk, region, instance_type='t2.micro', image_type='al2023', volume_size=8, volume_type='gp3', proxy_url=None, use_spot=False):
+# --- SSH Key Pairs ---
+def generate_ssh_key_pair():
     """
-    Step 1: Launch a base EC2 instance (Pure OS).
-    Returns: {status, ip, id, private_key, msg}
+    New RSA 2048 key for import_key_pair.
+    Returns: (private_key_pem, public_key_openssh)
     """
-    ami_id = None
-    if image_type == 'ubuntu':
-        if region not in AMI_MAPPING_UBUNTU:
-            return {'status': 'error', 'msg': f'Region {region} not supported for Ubuntu.'}
-        ami_id = AMI_MAPPING_UBUNTU[region]
-        user_name = "ubuntu"
-    else:
-        if region not in AMI_MAPPING:
-            return {'status': 'error', 'msg': f'Region {region} not supported for Amazon Linux.'}
-        ami_id = AMI_MAPPING[region]
-        user_name = "ec2-user"
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption()
+    ).decode()
+    return private_pem, public_key_from_private(private_pem)
+
+def public_key_from_private(private_pem):
+    """OpenSSH public key line for a PEM private key."""
+    from cryptography.hazmat.primitives import serialization
+
+    key = serialization.load_pem_private_key(private_pem.encode(), password=None)
+    return key.public_key().public_bytes(
+        encoding=serialization.Encoding.OpenSSH,
+        format=serialization.PublicFormat.OpenSSH
+    ).decode()
+
+def import_key_pair(ak, sk, region, key_name, public_key, proxy_url=None):
+    """
+    Register a public key in (account, region).
+    Returns: AWS KeyFingerprint. Raises on AWS errors.
+    """
+    ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    response = ec2.import_key_pair(KeyName=key_name, PublicKeyMaterial=public_key.encode())
+    return response.get('KeyFingerprint')
+
+def delete_key_pair(ak, sk, region, key_name, proxy_url=None):
+    """Remove a key pair from (account, region). Raises on AWS errors."""
+    ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    ec2.delete_key_pair(KeyName=key_name)
+
+# --- Launch Metadata Cache ---
+# Security group per (account, region) and root device per (region, AMI)
+# almost never change; cache them on disk and drop an entry when AWS rejects it.
+SG_CACHE_TTL = 24 * 3600
+ROOT_DEVICE_CACHE_TTL = 7 * 24 * 3600
+DEFAULT_ROOT_DEVICE = '/dev/xvda'
+SG_ERROR_CODES = ('InvalidGroup.NotFound', 'InvalidGroupId.NotFound', 'InvalidGroupId.Malformed')
+ROOT_DEVICE_ERROR_CODES = ('InvalidBlockDeviceMapping',)
+AMI_ERROR_CODES = ('InvalidAMIID.NotFound', 'InvalidAMIID.Unavailable', 'InvalidAMIID.Malformed')
+
+_sg_cache = PersistentTTLCache('security_groups', SG_CACHE_TTL)
+_root_device_cache = PersistentTTLCache('root_devices', ROOT_DEVICE_CACHE_TTL)
+
+def _account_key(ak):
+    """Stable, non-reversible account label for on-disk cache keys."""
+    return hashlib.sha256(ak.encode()).hexdigest()[:16]
+
+def get_security_group_id(ec2, ak, region):
+    """Cached ensure_security_group. Failures are not cached."""
+    key = f"{_account_key(ak)}|{region}"
+    sg_id = _sg_cache.get(key)
+    if sg_id:
+        return sg_id
+    sg_id = ensure_security_group(ec2)
+    if sg_id:
+        _sg_cache.set(key, sg_id)
+    return sg_id
 
-    config = Config(proxies={'https': proxy_url, 'http': proxy_url}) if proxy_url else None
+def invalidate_security_group(ak, region):
+    _sg_cache.invalidate(f"{_account_key(ak)}|{region}")
 
+def get_root_device_name(ec2, region, ami_id):
+    """Cached RootDeviceName for an AMI. Falls back to /dev/xvda (not cached)."""
+    key = f"{region}|{ami_id}"
+    root_device_name = _root_device_cache.get(key)
+    if root_device_name:
+        return root_device_name
     try:
-        session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region)
-        ec2 = session.client('ec2', config=config)
+        img_desc = ec2.describe_images(ImageIds=[ami_id])
+        root_device_name = img_desc['Images'][0]['RootDeviceName']
+        _root_device_cache.set(key, root_device_name)
+        return root_device_name
+    except Exception:
+        return DEFAULT_ROOT_DEVICE
 
-        # 0. Get Root Device Name for AMI
-        try:
-            img_desc = ec2.describe_images(ImageIds=[ami_id])
-            root_device_name = img_desc['Images'][0]['RootDeviceName']
-        except Exception:
-            root_device_name = '/dev/xvda' # Fallback
-
-        # 1. Create Key Pair
-        timestamp = int(time.time())
-        key_name = f"depin-base-{timestamp}"
-        
+def invalidate_root_device(region, ami_id):
+    _root_device_cache.invalidate(f"{region}|{ami_id}")
+
+# run_instances errors where a smaller batch may still go through
+PARTIAL_RETRY_CODES = ('InsufficientInstanceCapacity', 'InstanceLimitExceeded', 'VcpuLimitExceeded', 'MaxSpotInstanceCountExceeded')
+# Upper bound of instances requested per run_instances call
+MAX_LAUNCH_BATCH = 100
+
+# --- AMI Resolver ---
+# Public SSM parameters always point at the latest image in every region.
+# {arch} is x86_64/arm64 for Amazon Linux and amd64/arm64 for Ubuntu.
+AMI_SSM_PARAMETERS = {
+    'al2023': '/aws/service/ami-amazon-linux-latest/al2023-ami-kernel-default-{arch}',
+    'ubuntu22': '/aws/service/canonical/ubuntu/server/22.04/stable/current/{arch}/hvm/ebs-gp2/ami-id',
+    'ubuntu24': '/aws/service/canonical/ubuntu/server/24.04/stable/current/{arch}/hvm/ebs-gp3/ami-id',
+}
+# Legacy code 'ubuntu' means 22.04
+AMI_ALIASES = {'ubuntu': 'ubuntu22'}
+AMI_CACHE_TTL = 24 * 3600
+
+_ami_cache = PersistentTTLCache('amis', AMI_CACHE_TTL)
+
+def _ssm_arch(image_type, arch):
+    if image_type.startswith('ubuntu'):
+        return 'amd64' if arch == 'x86_64' else arch
+    return arch
+
+def resolve_ami(ak, sk, region, image_type='al2023', arch='x86_64', proxy_url=None):
+    """
+    Latest AMI for (region, OS, architecture) from the public SSM parameters.
+    Cached in-process and on disk; falls back to the built-in mappings.
+    Returns: (ami_id, error_msg)
+    """
+    image_type = AMI_ALIASES.get(image_type, image_type)
+    arch = arch or 'x86_64'
+    key = f"{region}|{image_type}|{arch}"
+    ami_id = _ami_cache.get(key)
+    if ami_id:
+        return ami_id, None
+
+    param_template = AMI_SSM_PARAMETERS.get(image_type)
+    if param_template:
         try:
-            key_pair = ec2.create_key_pair(KeyName=key_name)
-            private_key = key_pair['KeyMaterial']
-        except ClientError as e:
-            return {'status': 'error', 'msg': f"Failed to create Key Pair: {e}"}
-            
-        # 2. Ensure Security Group
-        sg_id = ensure_security_group(ec2)
-        if not sg_id:
-             return {'status': 'error', 'msg': "Failed to configure Security Group."}
-
-        # 3. Launch instance
-        # UserData to install basic tools (Docker, SSM Agent)
-        # Adapt for Ubuntu vs AL2023
-        if image_type == 'ubuntu':
-            base_user_data = """#!/bin/bash
+            ssm = get_client(ak, sk, region, 'ssm', proxy_url=proxy_url)
+            response = ssm.get_parameter(Name=param_template.format(arch=_ssm_arch(image_type, arch)))
+            ami_id = response['Parameter']['Value']
+            _ami_cache.set(key, ami_id)
+            return ami_id, None
+        except Exception as e:
+            print(f"AMI lookup via SSM failed ({key}): {e}")
+
+    # Fallback: hard-coded x86_64 images (AL2023 / Ubuntu 22.04 only)
+    if arch == 'x86_64':
+        if image_type == 'ubuntu22' and region in AMI_MAPPING_UBUNTU:
+            return AMI_MAPPING_UBUNTU[region], None
+        if image_type == 'al2023' and region in AMI_MAPPING:
+            return AMI_MAPPING[region], None
+    return None, f'No {image_type} ({arch}) image found for region {region}.'
+
+def invalidate_ami(region, image_type, arch='x86_64'):
+    image_type = AMI_ALIASES.get(image_type, image_type)
+    _ami_cache.invalidate(f"{region}|{image_type}|{arch or 'x86_64'}")
+
+def _base_user_data(image_type):
+    """UserData to install basic tools (Docker). Adapt for Ubuntu vs AL2023."""
+    if image_type.startswith('ubuntu'):
+        return """#!/bin/bash
 apt-get update -y
 apt-get install -y docker.io
 systemctl start docker
 systemctl enable docker
 usermod -aG docker ubuntu
 """
-        else:
-            base_user_data = """#!/bin/bash
+    return """#!/bin/bash
 yum update -y
 yum install -y docker
 service docker start
 usermod -a -G docker ec2-user
 systemctl enable docker
 """
+
+SPOT_MARKET_OPTIONS = {
+    'MarketType': 'spot',
+    'SpotOptions': {
+        'SpotInstanceType': 'one-time',
+        'InstanceInterruptionBehavior': 'terminate'
+    }
+}
+
+def _build_run_args(ami_id, instance_type, count, key_name, user_data, root_device_name, volume_size, volume_type, sg_id, use_spot, availability_zone=None):
+    """Prepare arguments for run_instances (MinCount=1 allows partial fulfilment)."""
+    run_args = {
+        'ImageId': ami_id,
+        'InstanceType': instance_type,
+        'MinCount': 1,
+        'MaxCount': count,
+        'KeyName': key_name,
+        'UserData': user_data,
         # Block Device Mapping for Root Volume
-        block_device_mappings = [
+        'BlockDeviceMappings': [
             {
                 'DeviceName': root_device_name,
                 'Ebs': {
@@ -241,137 +557,792 @@ systemctl enable docker
                     'DeleteOnTermination': True
                 }
             }
-        ]
-
-        # Prepare arguments for run_instances
-        run_args = {
-            'ImageId': ami_id,
-            'InstanceType': instance_type,
-            'MinCount': 1,
-            'MaxCount': 1,
-            'KeyName': key_name,
-            'UserData': base_user_data,
-            'BlockDeviceMappings': block_device_mappings,
-            'NetworkInterfaces': [{
-                'DeviceIndex': 0,
-                'AssociatePublicIpAddress': True,
-                'Groups': [sg_id]
-            }],
-            'TagSpecifications': [{
-                'ResourceType': 'instance',
-                'Tags': [
-                    {'Key': 'Name', 'Value': 'Base-Worker'},
-                    {'Key': 'Project', 'Value': 'Pending'} 
-                ]
-            }]
-        }
+        ],
+        'NetworkInterfaces': [{
+            'DeviceIndex': 0,
+            'AssociatePublicIpAddress': True,
+            'Groups': [sg_id]
+        }],
+        'TagSpecifications': [{
+            'ResourceType': 'instance',
+            'Tags': [
+                {'Key': 'Name', 'Value': 'Base-Worker'},
+                {'Key': 'Project', 'Value': 'Pending'} 
+            ]
+        }]
+    }
 
-        # Add Spot Options if enabled
-        if use_spot:
-            run_args['InstanceMarketOptions'] = {
-                'MarketType': 'spot',
-                'SpotOptions': {
-                    'SpotInstanceType': 'one-time',
-                    'InstanceInterruptionBehavior': 'terminate'
+    # Pin the AZ picked by the spot placement advisor
+    if availability_zone:
+        run_args['Placement'] = {'AvailabilityZone': availability_zone}
+
+    # Add Spot Options if enabled
+    if use_spot:
+        run_args['InstanceMarketOptions'] = SPOT_MARKET_OPTIONS
+    return run_args
+
+def _describe_launch_chunk(ec2, instance_ids):
+    """
+    One describe_instances for a chunk. Bisected on InvalidInstanceID.NotFound
+    (normal right after launch) so one unknown ID doesn't hide the rest;
+    IDs AWS doesn't know yet are simply left out.
+    """
+    try:
+        response = ec2.describe_instances(InstanceIds=instance_ids)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in NOT_FOUND_CODES:
+            raise
+        if len(instance_ids) == 1:
+            return {}
+        mid = len(instance_ids) // 2
+        state_map = _describe_launch_chunk(ec2, instance_ids[:mid])
+        state_map.update(_describe_launch_chunk(ec2, instance_ids[mid:]))
+        return state_map
+
+    state_map = {}
+    for r in response['Reservations']:
+        for i in r['Instances']:
+            state_map[i['InstanceId']] = {
+                'status': i['State']['Name'],
+                'ip': i.get('PublicIpAddress')
+            }
+    return state_map
+
+def _describe_launch_state(ec2, instance_ids):
+    """State and public IP for launched instances, chunked. Returns {id: {status, ip}}"""
+    state_map = {}
+    for n in range(0, len(instance_ids), STATUS_CHUNK_SIZE):
+        state_map.update(_describe_launch_chunk(ec2, instance_ids[n:n + STATUS_CHUNK_SIZE]))
+    return state_map
+
+def describe_launch_state(ak, sk, region, instance_ids, proxy_url=None):
+    """
+    Poll state + public IP of freshly launched instances.
+    Returns: {id: {status, ip}}; IDs not visible yet (NotFound) are missing.
+    Raises on other AWS errors.
+    """
+    ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    return _describe_launch_state(ec2, list(instance_ids))
+
+# --- Launch Templates ---
+# One template per (account, region, OS, arch, volume config). The AMI, user data,
+# disk, network and tags live in the template; run_instances only sends overrides.
+# A changed AMI/SG becomes a new template version, never a new template.
+LAUNCH_TEMPLATE_TTL = 24 * 3600
+LAUNCH_TEMPLATE_ERROR_CODES = (
+    'InvalidLaunchTemplateId.NotFound', 'InvalidLaunchTemplateId.VersionNotFound',
+    'InvalidLaunchTemplateName.NotFoundException', 'InvalidLaunchTemplateId.Malformed'
+)
+
+_template_cache = PersistentTTLCache('launch_templates', LAUNCH_TEMPLATE_TTL)
+
+def _template_key(ak, region, image_type, arch, volume_size, volume_type, key_name=None):
+    image_type = AMI_ALIASES.get(image_type, image_type)
+    key = f"{_account_key(ak)}|{region}|{image_type}|{arch or 'x86_64'}|{int(volume_size)}|{volume_type}"
+    # EC2 Fleet can't override KeyName, so fleet templates carry the key
+    return f"{key}|{key_name}" if key_name else key
+
+def _build_template_data(ami_id, user_data, root_device_name, volume_size, volume_type, sg_id):
+    """LaunchTemplateData equivalent of _build_run_args (UserData must be base64 here)."""
+    return {
+        'ImageId': ami_id,
+        'UserData': base64.b64encode(user_data.encode()).decode(),
+        'BlockDeviceMappings': [
+            {
+                'DeviceName': root_device_name,
+                'Ebs': {
+                    'VolumeSize': int(volume_size),
+                    'VolumeType': volume_type,
+                    'DeleteOnTermination': True
                 }
             }
+        ],
+        'NetworkInterfaces': [{
+            'DeviceIndex': 0,
+            'AssociatePublicIpAddress': True,
+            'Groups': [sg_id]
+        }],
+        'TagSpecifications': [{
+            'ResourceType': 'instance',
+            'Tags': [
+                {'Key': 'Name', 'Value': 'Base-Worker'},
+                {'Key': 'Project', 'Value': 'Pending'}
+            ]
+        }]
+    }
 
-        response = ec2.run_instances(**run_args)
+def _ensure_template_version(ec2, name, data):
+    """
+    Create the named template, or add a version when its latest data differs.
+    The data digest is stored as the version description.
+    Returns: {id, version}. Raises on AWS errors.
+    """
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+    try:
+        lt = ec2.describe_launch_templates(LaunchTemplateNames=[name])['LaunchTemplates'][0]
+    except ClientError as e:
+        if e.response['Error']['Code'] not in LAUNCH_TEMPLATE_ERROR_CODES:
+            raise
+        try:
+            lt = ec2.create_launch_template(LaunchTemplateName=name, VersionDescription=digest, LaunchTemplateData=data)['LaunchTemplate']
+            return {'id': lt['LaunchTemplateId'], 'version': lt['LatestVersionNumber']}
+        except ClientError as ce:
+            # Created concurrently by another worker
+            if ce.response['Error']['Code'] != 'InvalidLaunchTemplateName.AlreadyExistsException':
+                raise
+            lt = ec2.describe_launch_templates(LaunchTemplateNames=[name])['LaunchTemplates'][0]
 
-        instance_id = response['Instances'][0]['InstanceId']
+    latest = ec2.describe_launch_template_versions(LaunchTemplateId=lt['LaunchTemplateId'], Versions=['$Latest'])['LaunchTemplateVersions'][0]
+    if latest.get('VersionDescription') == digest:
+        return {'id': lt['LaunchTemplateId'], 'version': latest['VersionNumber']}
 
-        # Wait for running
-        waiter = ec2.get_waiter('instance_running')
-        waiter.wait(InstanceIds=[instance_id])
+    version = ec2.create_launch_template_version(
+        LaunchTemplateId=lt['LaunchTemplateId'], VersionDescription=digest, LaunchTemplateData=data
+    )['LaunchTemplateVersion']
+    return {'id': lt['LaunchTemplateId'], 'version': version['VersionNumber']}
 
-        # Get IP
-        desc_response = ec2.describe_instances(InstanceIds=[instance_id])
-        instance_data = desc_response['Reservations'][0]['Instances'][0]
-        public_ip = instance_data.get('PublicIpAddress', 'N/A')
+def get_launch_template(ec2, ak, sk, region, image_type='al2023', arch='x86_64', volume_size=8, volume_type='gp3', proxy_url=None, refresh=False, key_name=None):
+    """
+    Cached launch template for (account, region, OS, arch, volume config).
+    A cache hit needs no AWS call at all (AMI/SG/root device lookups included).
+    key_name: bake the key pair into the template (needed by create_fleet).
+    Returns: (template {id, version}, error_msg). Raises on launch template API errors.
+    """
+    key = _template_key(ak, region, image_type, arch, volume_size, volume_type, key_name)
+    if not refresh:
+        template = _template_cache.get(key)
+        if template:
+            return template, None
+
+    ami_id, ami_err = resolve_ami(ak, sk, region, image_type, arch, proxy_url=proxy_url)
+    if not ami_id:
+        return None, ami_err
+    root_device_name = get_root_device_name(ec2, region, ami_id)
+    sg_id = get_security_group_id(ec2, ak, region)
+    if not sg_id:
+        return None, "Failed to configure Security Group."
+
+    data = _build_template_data(ami_id, _base_user_data(AMI_ALIASES.get(image_type, image_type)), root_device_name, volume_size, volume_type, sg_id)
+    if key_name:
+        data['KeyName'] = key_name
+    name = f"depin-{hashlib.sha256(key.encode()).hexdigest()[:16]}"
+    template = _ensure_template_version(ec2, name, data)
+    template['ami_id'] = ami_id
+    _template_cache.set(key, template)
+    return template, None
+
+def _build_template_run_args(template, instance_type, count, key_name, use_spot, availability_zone=None):
+    """Minimal run_instances arguments on top of a launch template."""
+    run_args = {
+        'LaunchTemplate': {'LaunchTemplateId': template['id'], 'Version': str(template['version'])},
+        'InstanceType': instance_type,
+        'MinCount': 1,
+        'MaxCount': count,
+        'KeyName': key_name
+    }
+    if availability_zone:
+        run_args['Placement'] = {'AvailabilityZone': availability_zone}
+    if use_spot:
+        run_args['InstanceMarketOptions'] = SPOT_MARKET_OPTIONS
+    return run_args
+
+def launch_base_instances(ak, sk, region, count=1, instance_type='t2.micro', image_type='al2023', volume_size=8, volume_type='gp3', proxy_url=None, use_spot=False, wait=True, arch='x86_64', key_name=None, availability_zone=None, use_template=True):
+    """
+    Launch `count` base EC2 instances (Pure OS) with as few run_instances calls as possible.
+    All instances of the batch share one key pair and one waiter.
+    key_name: existing (registered) key pair; private_key is then None in the result.
+    availability_zone: pin the placement (e.g. from spot_advisor.rank_placements).
+    use_template: launch from the cached launch template; falls back to full
+    run_instances arguments if templates can't be used (e.g. missing IAM permission).
+    wait=False returns right after run_instances (ip None, state 'pending');
+    use launch_tracker to fill in IPs in the background.
+    Returns: {status, instances: [{id, ip}], private_key, requested, launched, msg}
+      status: 'success' (all launched), 'partial' (some launched) or 'error'
+    """
+    count = int(count)
+    if count < 1:
+        return {'status': 'error', 'msg': 'Count must be >= 1', 'instances': [], 'requested': count, 'launched': 0}
+
+    try:
+        ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+
+        # 0. Launch template (cached) or the AMI/SG/root device it bundles
+        template = None
+        if use_template:
+            try:
+                template, meta_err = get_launch_template(ec2, ak, sk, region, image_type, arch, volume_size, volume_type, proxy_url=proxy_url)
+            except ClientError as e:
+                print(f"Launch template unavailable ({region}), using full arguments: {e}")
+                meta_err = None
+            if meta_err:
+                return {'status': 'error', 'msg': meta_err, 'instances': [], 'requested': count, 'launched': 0}
+
+        if template is None:
+            ami_id, ami_err = resolve_ami(ak, sk, region, image_type, arch, proxy_url=proxy_url)
+            if not ami_id:
+                return {'status': 'error', 'msg': ami_err, 'instances': [], 'requested': count, 'launched': 0}
+            root_device_name = get_root_device_name(ec2, region, ami_id)
+            sg_id = get_security_group_id(ec2, ak, region)
+            if not sg_id:
+                return {'status': 'error', 'msg': "Failed to configure Security Group.", 'instances': [], 'requested': count, 'launched': 0}
+            user_data = _base_user_data(image_type)
+        else:
+            ami_id = template.get('ami_id')
+
+        # 1. Key Pair: reuse the registered account key, else create one per batch
+        private_key = None
+        if not key_name:
+            key_name = f"depin-base-{int(time.time())}-{uuid.uuid4().hex[:6]}"
+            
+            try:
+                key_pair = ec2.create_key_pair(KeyName=key_name)
+                private_key = key_pair['KeyMaterial']
+            except ClientError as e:
+                return {'status': 'error', 'msg': f"Failed to create Key Pair: {e}", 'instances': [], 'requested': count, 'launched': 0}
+
+        # 2. Launch in as few calls as possible, shrinking the batch on capacity errors
+        launched_ids = []
+        errors = []
+        remaining = count
+        batch = min(remaining, MAX_LAUNCH_BATCH)
+        metadata_refreshed = False
+
+        try:
+            while remaining > 0 and batch >= 1:
+                if template:
+                    run_args = _build_template_run_args(template, instance_type, batch, key_name, use_spot, availability_zone)
+                else:
+                    run_args = _build_run_args(ami_id, instance_type, batch, key_name, user_data, root_device_name, volume_size, volume_type, sg_id, use_spot, availability_zone)
+                try:
+                    response = ec2.run_instances(**run_args)
+                except ClientError as e:
+                    code = e.response['Error']['Code']
+                    # Stale cached metadata: drop it, look it up again and retry once
+                    if code in SG_ERROR_CODES + ROOT_DEVICE_ERROR_CODES + AMI_ERROR_CODES + LAUNCH_TEMPLATE_ERROR_CODES and not metadata_refreshed:
+                        metadata_refreshed = True
+                        if code in SG_ERROR_CODES:
+                            invalidate_security_group(ak, region)
+                        elif code in AMI_ERROR_CODES:
+                            invalidate_ami(region, image_type, arch)
+                        elif code in ROOT_DEVICE_ERROR_CODES and ami_id:
+                            invalidate_root_device(region, ami_id)
+
+                        if template:
+                            # Rebuild the template (new version) from fresh metadata
+                            template, meta_err = get_launch_template(ec2, ak, sk, region, image_type, arch, volume_size, volume_type, proxy_url=proxy_url, refresh=True)
+                            if not template:
+                                errors.append(meta_err)
+                                break
+                            ami_id = template.get('ami_id')
+                        elif code in SG_ERROR_CODES:
+                            sg_id = get_security_group_id(ec2, ak, region)
+                            if not sg_id:
+                                errors.append("Failed to configure Security Group.")
+                                break
+                        elif code in AMI_ERROR_CODES:
+                            ami_id, ami_err = resolve_ami(ak, sk, region, image_type, arch, proxy_url=proxy_url)
+                            if not ami_id:
+                                errors.append(ami_err)
+                                break
+                            root_device_name = get_root_device_name(ec2, region, ami_id)
+                        else:
+                            root_device_name = get_root_device_name(ec2, region, ami_id)
+                        continue
+                    if code in PARTIAL_RETRY_CODES and batch > 1:
+                        errors.append(f"{code} at {batch}")
+                        batch = batch // 2
+                        continue
+                    errors.append(str(e))
+                    break
+
+                ids = [i['InstanceId'] for i in response['Instances']]
+                launched_ids.extend(ids)
+                record_usage_delta(ak, region, sum(_instance_vcpus(i) for i in response['Instances']))
+                remaining -= len(ids)
+                if len(ids) < batch:
+                    # AWS granted fewer than MaxCount -> capacity exhausted for now
+                    errors.append(f"Only {len(ids)}/{batch} granted")
+                    break
+                batch = min(remaining, MAX_LAUNCH_BATCH)
+        except Exception as e:
+            # Network/throttling errors or a failed metadata refresh mid-batch:
+            # keep the IDs already launched so the caller can log or roll them back
+            errors.append(str(e))
+
+        if not launched_ids:
+            return {'status': 'error', 'msg': '; '.join(errors) or 'No instances launched', 'instances': [], 'requested': count, 'launched': 0, 'private_key': private_key}
+
+        # 3. One waiter for every launched ID, then one describe for IPs
+        ip_map = {}
+        if wait:
+            try:
+                waiter = ec2.get_waiter('instance_running')
+                for n in range(0, len(launched_ids), STATUS_CHUNK_SIZE):
+                    waiter.wait(InstanceIds=launched_ids[n:n + STATUS_CHUNK_SIZE])
+                ip_map = {i_id: st['ip'] or 'N/A' for i_id, st in _describe_launch_state(ec2, launched_ids).items()}
+            except Exception as e:
+                # Instances exist; return them so the caller can log or roll back
+                errors.append(f"Wait failed: {e}")
+
+        instances = [{'id': i_id, 'ip': ip_map.get(i_id, 'N/A' if wait else None)} for i_id in launched_ids]
+        status = 'success' if len(launched_ids) == count else 'partial'
+        msg = f"Launched {len(launched_ids)}/{count} base instances."
+        if errors:
+            msg += f" ({'; '.join(errors)})"
 
         return {
-            'status': 'success',
-            'ip': public_ip,
-            'id': instance_id,
-            'msg': 'Base Instance launched.',
-            'private_key': private_key
+            'status': status,
+            'instances': instances,
+            'private_key': private_key,
+            'requested': count,
+            'launched': len(launched_ids),
+            'msg': msg
         }
 
     except Exception as e:
-        return {'status': 'error', 'msg': str(e)}
+        return {'status': 'error', 'msg': str(e), 'instances': [], 'requested': count, 'launched': 0}
+
+# --- EC2 Fleet (instant) ---
+# Spread one request over several instance types and every default subnet (AZ)
+FLEET_MAX_OVERRIDES = 300
+# Largest substitute type, in multiples of the selected type's vCPUs
+FLEET_MAX_WEIGHT = 4
+SUBNET_CACHE_TTL = 6 * 3600
+_subnet_cache = TTLCache(SUBNET_CACHE_TTL)
+
+def get_default_subnets(ec2, ak, region):
+    """Default subnet per AZ: [{az, subnet_id}] (cached per account/region)."""
+    key = (ak, region)
+    subnets = _subnet_cache.get(key)
+    if subnets is None:
+        response = ec2.describe_subnets(Filters=[{'Name': 'default-for-az', 'Values': ['true']}])
+        subnets = [{'az': s['AvailabilityZone'], 'subnet_id': s['SubnetId']} for s in response.get('Subnets', [])]
+        _subnet_cache.set(key, subnets)
+    return subnets
+
+def fleet_type_weights(base_type, candidate_types, max_weight=FLEET_MAX_WEIGHT):
+    """
+    {type: weight} for a fleet standing in for base_type. Candidates need at
+    least its vCPUs and memory (catalog specs; unknown types are skipped) and
+    weigh vCPUs / base vCPUs, so the target capacity counts base_type
+    instances. Types heavier than max_weight are left out.
+    """
+    base = get_instance_spec(base_type) or {}
+    base_vcpu = base.get('vcpu') or get_type_vcpus(base_type)
+    base_mem = base.get('memory_gb') or 0
+    weights = {base_type: 1.0}
+    for t in candidate_types:
+        spec = get_instance_spec(t)
+        if t == base_type or not spec or not spec.get('vcpu'):
+            continue
+        if spec.get('arch') and base.get('arch') and spec['arch'] != base['arch']:
+            continue
+        weight = spec['vcpu'] / base_vcpu
+        if weight < 1 or weight > max_weight or (spec.get('memory_gb') or 0) < base_mem:
+            continue
+        weights[t] = round(weight, 3)
+    return weights
+
+def _fleet_overrides(instance_types, subnets, arch):
+    """
+    Overrides for every (type, subnet). instance_types: {type: weight} or [type, ...].
+    Types known to the catalog with a different architecture than the AMI are skipped.
+    Lightest types come first and are kept whole when FLEET_MAX_OVERRIDES cuts the list.
+    """
+    weights = instance_types if isinstance(instance_types, dict) else {t: 1 for t in instance_types}
+    subnets = subnets or [None]
+    max_types = max(1, FLEET_MAX_OVERRIDES // len(subnets))
+
+    def arch_matches(t):
+        spec_arch = (get_instance_spec(t) or {}).get('arch')
+        return not spec_arch or spec_arch == (arch or 'x86_64')
+
+    types = [t for t in sorted(weights, key=lambda t: float(weights[t] or 1)) if arch_matches(t)]
+    overrides = []
+    for t in types[:max_types]:
+        for subnet in subnets:
+            o = {'InstanceType': t, 'WeightedCapacity': float(weights[t] or 1)}
+            if subnet:
+                o['SubnetId'] = subnet['subnet_id']
+                o['AvailabilityZone'] = subnet['az']
+            overrides.append(o)
+    return overrides[:FLEET_MAX_OVERRIDES]
+
+def launch_fleet(ak, sk, region, instance_types, count=1, key_name=None, image_type='al2023', volume_size=8, volume_type='gp3', proxy_url=None, use_spot=False, arch='x86_64'):
+    """
+    Launch `count` capacity units in one create_fleet(Type='instant') call,
+    letting EC2 pick among several instance types and AZs.
+    instance_types: {type: weight} or [type, ...] (weight 1 = one unit per instance;
+      see fleet_type_weights for weights relative to one selected type)
+    key_name: registered key pair (required: fleets can't create keys).
+    Returns: {status, instances: [{id, ip, instance_type, az}], requested, launched, msg}
+      launched counts instances; status is 'success' once the target capacity is met.
+    """
+    count = int(count)
+    if count < 1:
+        return {'status': 'error', 'msg': 'Count must be >= 1', 'instances': [], 'requested': count, 'launched': 0}
+    if not key_name:
+        return {'status': 'error', 'msg': 'Fleet launch needs a registered key pair', 'instances': [], 'requested': count, 'launched': 0}
+
+    try:
+        ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+        template, meta_err = get_launch_template(ec2, ak, sk, region, image_type, arch, volume_size, volume_type, proxy_url=proxy_url, key_name=key_name)
+        if not template:
+            return {'status': 'error', 'msg': meta_err, 'instances': [], 'requested': count, 'launched': 0}
+
+        overrides = _fleet_overrides(instance_types, get_default_subnets(ec2, ak, region), arch)
+        if not overrides:
+            return {'status': 'error', 'msg': f'No instance type matches architecture {arch}', 'instances': [], 'requested': count, 'launched': 0}
+
+        fleet_args = {
+            'Type': 'instant',
+            'LaunchTemplateConfigs': [{
+                'LaunchTemplateSpecification': {'LaunchTemplateId': template['id'], 'Version': str(template['version'])},
+                'Overrides': overrides
+            }],
+            'TargetCapacitySpecification': {
+                'TotalTargetCapacity': count,
+                'DefaultTargetCapacityType': 'spot' if use_spot else 'on-demand'
+            }
+        }
+        if use_spot:
+            fleet_args['SpotOptions'] = {'AllocationStrategy': 'price-capacity-optimized'}
+        else:
+            fleet_args['OnDemandOptions'] = {'AllocationStrategy': 'lowest-price'}
+
+        response = ec2.create_fleet(**fleet_args)
+
+        instances = []
+        vcpus = 0
+        for group in response.get('Instances', []):
+            i_type = group.get('InstanceType')
+            az = group.get('LaunchTemplateAndOverrides', {}).get('Overrides', {}).get('AvailabilityZone')
+            for i_id in group.get('InstanceIds', []):
+                instances.append({'id': i_id, 'ip': None, 'instance_type': i_type, 'az': az})
+                vcpus += get_type_vcpus(i_type)
+        if vcpus:
+            record_usage_delta(ak, region, vcpus)
+
+        errors = sorted({f"{e.get('ErrorCode')}: {e.get('ErrorMessage')}" for e in response.get('Errors', [])})
+        if not instances:
+            return {'status': 'error', 'msg': '; '.join(errors) or 'No instances launched', 'instances': [], 'requested': count, 'launched': 0}
+
+        weights = instance_types if isinstance(instance_types, dict) else {}
+        units = sum(float(weights.get(i['instance_type'], 1) or 1) for i in instances)
+        status = 'success' if units >= count else 'partial'
+        msg = f"Fleet launched {len(instances)} instances ({units:g}/{count} units)."
+        if errors:
+            msg += f" ({'; '.join(errors)})"
+        return {
+            'status': status,
+            'instances': instances,
+            'requested': count,
+            'launched': len(instances),
+            'msg': msg
+        }
+
+    except Exception as e:
+        return {'status': 'error', 'msg': str(e), 'instances': [], 'requested': count, 'launched': 0}
+
+def launch_base_instance(ak, sk, region, instance_type='t2.micro', image_type='al2023', volume_size=8, volume_type='gp3', proxy_url=None, use_spot=False, arch='x86_64', key_name=None):
+    """
+    Step 1: Launch a base EC2 instance (Pure OS).
+    Returns: {status, ip, id, private_key, msg}
+    """
+    res = launch_base_instances(ak, sk, region, count=1, instance_type=instance_type, image_type=image_type,
+                                volume_size=volume_size, volume_type=volume_type, proxy_url=proxy_url, use_spot=use_spot, arch=arch, key_name=key_name)
+    if res['status'] == 'error':
+        return {'status': 'error', 'msg': res['msg']}
+
+    inst = res['instances'][0]
+    return {
+        'status': 'success',
+        'ip': inst['ip'],
+        'id': inst['id'],
+        'msg': 'Base Instance launched.',
+        'private_key': res['private_key']
+    }
+
+# Max IDs per DescribeInstanceStatus / DescribeInstances call
+STATUS_CHUNK_SIZE = 100
+NOT_FOUND_CODES = ('InvalidInstanceID.NotFound', 'InvalidInstanceID.Malformed')
 
-# Re-export other functions for compatibility
-def get_instance_status(ak, sk, region, instance_ids, proxy_url=None):
+def _describe_status_chunk(ec2, instance_ids, use_status_api=False):
+    """
+    Resolve states for one chunk of IDs.
+    On InvalidInstanceID.NotFound the chunk is bisected so one stale ID
+    doesn't hide the rest. Returns (status_map, missing_ids).
+    """
+    try:
+        status_map = {}
+        if use_status_api:
+            # Lighter payload: state only, no full instance description
+            response = ec2.describe_instance_status(InstanceIds=instance_ids, IncludeAllInstances=True)
+            for s in response.get('InstanceStatuses', []):
+                status_map[s['InstanceId']] = s['InstanceState']['Name']
+        else:
+            response = ec2.describe_instances(InstanceIds=instance_ids)
+            for r in response['Reservations']:
+                for i in r['Instances']:
+                    status_map[i['InstanceId']] = i['State']['Name']
+        return status_map, []
+    except ClientError as e:
+        if e.response['Error']['Code'] not in NOT_FOUND_CODES:
+            raise
+        if len(instance_ids) == 1:
+            return {}, list(instance_ids)
+        mid = len(instance_ids) // 2
+        left_map, left_missing = _describe_status_chunk(ec2, instance_ids[:mid], use_status_api)
+        right_map, right_missing = _describe_status_chunk(ec2, instance_ids[mid:], use_status_api)
+        left_map.update(right_map)
+        return left_map, left_missing + right_missing
+
+def describe_region_status(ak, sk, region, instance_ids, proxy_url=None, use_status_api=False):
+    """
+    Chunked status lookup for one (credential, region).
+    Returns: (status_map, missing_ids). Raises on non-NotFound AWS errors.
+    """
+    ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    ids = list(dict.fromkeys(instance_ids))  # dedupe, keep order
+    status_map = {}
+    missing = []
+    for n in range(0, len(ids), STATUS_CHUNK_SIZE):
+        chunk_map, chunk_missing = _describe_status_chunk(ec2, ids[n:n + STATUS_CHUNK_SIZE], use_status_api)
+        status_map.update(chunk_map)
+        missing.extend(chunk_missing)
+    return status_map, missing
+
+def get_instance_status(ak, sk, region, instance_ids, proxy_url=None, use_status_api=False):
     """Get status."""
     if not instance_ids: return {}
-    config = Config(proxies={'https': proxy_url, 'http': proxy_url}) if proxy_url else None
     try:
-        session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region)
-        ec2 = session.client('ec2', config=config)
-        response = ec2.describe_instances(InstanceIds=instance_ids)
-        status_map = {}
-        for r in response['Reservations']:
-            for i in r['Instances']:
-                status_map[i['InstanceId']] = i['State']['Name']
+        status_map, _ = describe_region_status(ak, sk, region, instance_ids, proxy_url=proxy_url, use_status_api=use_status_api)
         return status_map
     except Exception as e:
+        if is_throttling_error(e):
+            raise
         return {}
 
+def get_fleet_status(batches, use_status_api=True, max_workers=20):
+    """
+    Resolve instance states for a whole fleet in one call.
+    batches: list of dicts {account, ak, sk, region, instance_ids, proxy_url}
+    ('account' is any label, e.g. the credential id).
+    Returns: {status_map, missing, errors, timing}
+      status_map: merged {instance_id: state}
+      missing:    IDs AWS reported as not found
+      errors:     {account: [msg, ...]}
+      timing:     {account: seconds spent across its regions}
+    """
+    result = {"status_map": {}, "missing": [], "errors": {}, "timing": {}}
+    if not batches:
+        return result
+
+    def worker(b):
+        t0 = time.time()
+        try:
+            status_map, missing = describe_region_status(
+                b['ak'], b['sk'], b['region'], b['instance_ids'],
+                proxy_url=b.get('proxy_url'), use_status_api=use_status_api
+            )
+            return b, status_map, missing, None, time.time() - t0
+        except Exception as e:
+            return b, {}, [], f"{b['region']}: {e}", time.time() - t0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(worker, b) for b in batches if b.get('instance_ids')]
+        for future in as_completed(futures):
+            b, status_map, missing, err, elapsed = future.result()
+            account = b.get('account')
+            result["status_map"].update(status_map)
+            result["missing"].extend(missing)
+            result["timing"][account] = round(result["timing"].get(account, 0) + elapsed, 3)
+            if err:
+                result["errors"].setdefault(account, []).append(err)
+    return result
+
+# States worth syncing; terminated instances are filtered server-side
+# (sync_instances treats anything missing from the scan as gone).
+SCAN_STATES = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+SCAN_PAGE_SIZE = 500
+
+def _trim_instance(i, region):
+    """Project a raw describe_instances entry down to the fields we store."""
+    p_name = 'Unknown'
+    for t in i.get('Tags', []):
+        if t['Key'] == 'Project':
+            p_name = t['Value']
+            break
+    return {
+        'instance_id': i['InstanceId'],
+        'status': i['State']['Name'],
+        'ip_address': i.get('PublicIpAddress', None),
+        'project_name': p_name,
+        'region': region,
+        'instance_type': i.get('InstanceType', 'Unknown')
+    }
+
+def iter_instance_pages(ak, sk, region, proxy_url=None, states=None, page_size=SCAN_PAGE_SIZE):
+    """
+    Paginate describe_instances and yield one list of trimmed instances per page.
+    Raises on AWS errors so callers can tell "no instances" from "scan failed".
+    """
+    ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    paginator = ec2.get_paginator('describe_instances')
+    pages = paginator.paginate(
+        Filters=[{'Name': 'instance-state-name', 'Values': states or SCAN_STATES}],
+        PaginationConfig={'PageSize': page_size}
+    )
+    for page in pages:
+        batch = []
+        for r in page.get('Reservations', []):
+            for i in r.get('Instances', []):
+                batch.append(_trim_instance(i, region))
+        if batch:
+            yield batch
+
+def iter_instances(ak, sk, region, proxy_url=None, states=None):
+    """Stream trimmed instances one at a time across all pages."""
+    for batch in iter_instance_pages(ak, sk, region, proxy_url=proxy_url, states=states):
+        yield from batch
+
 def scan_all_instances(ak, sk, region, proxy_url=None):
-    """Scan all instances."""
-    config = Config(proxies={'https': proxy_url, 'http': proxy_url}) if proxy_url else None
+    """Scan all instances (materialized list; prefer iter_instances for large accounts)."""
     try:
-        session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region)
-        ec2 = session.client('ec2', config=config)
-        response = ec2.describe_instances()
-        instances = []
-        for r in response['Reservations']:
-            for i in r['Instances']:
-                p_name = 'Unknown'
-                if 'Tags' in i:
-                    for t in i['Tags']:
-                        if t['Key'] == 'Project':
-                            p_name = t['Value']
-                            break
-                instances.append({
-                    'instance_id': i['InstanceId'],
-                    'status': i['State']['Name'],
-                    'ip_address': i.get('PublicIpAddress', None),
-                    'project_name': p_name,
-                    'region': region,
-                    'instance_type': i.get('InstanceType', 'Unknown')
-                })
-        return instances
-    except Exception:
+        return list(iter_instances(ak, sk, region, proxy_url=proxy_url))
+    except Exception as e:
+        # An empty list would read as "no instances" and wipe DB rows on sync
+        if is_throttling_error(e):
+            raise
         return []
 
-def terminate_instance(ak, sk, region, instance_id, proxy_url=None):
+def terminate_instance(ak, sk, region, instance_id, proxy_url=None, vcpus=None):
     """Terminate instance."""
-    config = Config(proxies={'https': proxy_url, 'http': proxy_url}) if proxy_url else None
     try:
-        session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name=region)
-        ec2 = session.client('ec2', config=config)
+        ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
         ec2.terminate_instances(InstanceIds=[instance_id])
+        if vcpus:
+            record_usage_delta(ak, region, -vcpus)
+        else:
+            mark_usage_stale(ak, region)
         return {'status': 'success', 'msg': 'Terminating...'}
     except Exception as e:
         return {'status': 'error', 'msg': str(e)}
 
-def check_account_health(ak, sk, proxy_url=None):
-    """Health check."""
-    config = Config(proxies={'https': proxy_url, 'http': proxy_url}) if proxy_url else None
+# --- Bulk Terminate ---
+# TerminateInstances accepts up to 1000 IDs per call
+TERMINATE_CHUNK_SIZE = 1000
+# Errors that fail the whole call because of a single ID -> bisect to isolate it
+TERMINATE_BISECT_CODES = NOT_FOUND_CODES + ('OperationNotPermitted',)
+
+def _terminate_chunk(ec2, instance_ids):
+    """
+    Terminate one chunk of IDs. Returns {instance_id: {status, state, msg}}.
+    An ID that is already gone is reported as 'not_found'.
+    """
     try:
-        session = boto3.Session(aws_access_key_id=ak, aws_secret_access_key=sk, region_name='us-east-1')
-        ec2 = session.client('ec2', config=config)
-        ec2.describe_regions(DryRun=False)
-        return {'status': 'active', 'msg': 'Normal'}
+        response = ec2.terminate_instances(InstanceIds=instance_ids)
     except ClientError as e:
+        code = e.response['Error']['Code']
+        if code not in TERMINATE_BISECT_CODES:
+            return {i_id: {'status': 'error', 'state': None, 'msg': str(e)} for i_id in instance_ids}
+        if len(instance_ids) == 1:
+            status = 'not_found' if code in NOT_FOUND_CODES else 'error'
+            return {instance_ids[0]: {'status': status, 'state': None, 'msg': code}}
+        mid = len(instance_ids) // 2
+        results = _terminate_chunk(ec2, instance_ids[:mid])
+        results.update(_terminate_chunk(ec2, instance_ids[mid:]))
+        return results
+
+    results = {}
+    for t in response.get('TerminatingInstances', []):
+        results[t['InstanceId']] = {'status': 'success', 'state': t['CurrentState']['Name'], 'msg': 'Terminating...'}
+    # IDs AWS accepted but didn't echo back
+    for i_id in instance_ids:
+        results.setdefault(i_id, {'status': 'error', 'state': None, 'msg': 'Not acknowledged by AWS'})
+    return results
+
+def terminate_instances(ak, sk, region, instance_ids, proxy_url=None):
+    """
+    Terminate many instances of one (credential, region) in chunks of 1000.
+    Returns: {instance_id: {status: success|not_found|error, state, msg}}
+    """
+    ids = list(dict.fromkeys(instance_ids))
+    if not ids:
+        return {}
+    try:
+        ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    except Exception as e:
+        return {i_id: {'status': 'error', 'state': None, 'msg': str(e)} for i_id in ids}
+
+    results = {}
+    for n in range(0, len(ids), TERMINATE_CHUNK_SIZE):
+        results.update(_terminate_chunk(ec2, ids[n:n + TERMINATE_CHUNK_SIZE]))
+
+    # Instance types aren't in the response; recount usage on the next capacity check
+    if any(r['status'] == 'success' for r in results.values()):
+        mark_usage_stale(ak, region)
+    return results
+
+# --- Account Health ---
+# Identity probe results are memoized per access key; repeated checks are free
+HEALTH_PROBE_TTL = int(os.environ.get("DEPIN_HEALTH_PROBE_TTL", 300))
+INVALID_CREDENTIAL_CODES = ('InvalidClientTokenId', 'SignatureDoesNotMatch', 'AuthFailure', 'UnrecognizedClientException', 'IncompleteSignature')
+
+_health_cache = TTLCache(HEALTH_PROBE_TTL)
+
+def classify_account_error(e):
+    """Map an AWS error to a credential health result {status, msg}."""
+    if isinstance(e, ClientError):
         c = e.response['Error']['Code']
-        if c == 'AuthFailure': return {'status': 'error', 'msg': 'Invalid Credentials'}
+        if c in INVALID_CREDENTIAL_CODES: return {'status': 'error', 'msg': 'Invalid Credentials'}
         elif c == 'OptInRequired': return {'status': 'suspended', 'msg': 'OptInRequired'}
-        elif 'Suspended' in str(e): return {'status': 'suspended', 'msg': 'Suspended'}
-        else: return {'status': 'error', 'msg': str(e)}
+        elif 'Suspended' in str(e) or 'Blocked' in str(e): return {'status': 'suspended', 'msg': 'Suspended'}
+    return {'status': 'error', 'msg': str(e)}
+
+def check_account_health(ak, sk, proxy_url=None, refresh=False):
+    """
+    Health check via STS GetCallerIdentity (the lightest signed call; needs no
+    IAM permission). Memoized per credential for HEALTH_PROBE_TTL.
+    Returns: {status, msg, account_id, cached}
+    """
+    key = (ak, sk)
+    if not refresh:
+        cached = _health_cache.get(key)
+        if cached:
+            return {**cached, 'cached': True}
+
+    try:
+        sts = get_client(ak, sk, 'us-east-1', 'sts', proxy_url=proxy_url)
+        identity = sts.get_caller_identity()
+        result = {'status': 'active', 'msg': 'Normal', 'account_id': identity.get('Account')}
     except Exception as e:
-        return {'status': 'error', 'msg': str(e)}
+        # Throttled or unreachable says nothing about the account: don't cache it
+        if is_throttling_error(e) or not isinstance(e, ClientError):
+            return {'status': 'error', 'msg': str(e), 'account_id': None, 'cached': False}
+        result = {**classify_account_error(e), 'account_id': None}
+
+    _health_cache.set(key, result)
+    return {**result, 'cached': False}
+
+def check_ec2_access(ak, sk, region, proxy_url=None):
+    """
+    One EC2 call (DescribeRegions) to catch what STS can't see: accounts not
+    yet verified for EC2 (OptInRequired) or blocked/suspended by AWS.
+    Returns {status, msg}, or None when the answer is inconclusive (throttled,
+    network error) and the STS result should stand.
+    """
+    try:
+        ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+        ec2.describe_regions(RegionNames=[region])
+        return {'status': 'active', 'msg': 'Normal'}
+    except Exception as e:
+        if is_throttling_error(e) or not isinstance(e, ClientError):
+            return None
+        return classify_account_error(e)
+
+def invalidate_account_health(ak):
+    _health_cache.invalidate_where(lambda k: k[0] == ak)
 
 # --- Deprecated but kept for compatibility if needed ---
 def launch_instance(ak, sk, region, user_data, project_name, proxy_url=None):
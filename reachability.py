@@ -0,0 +1,89 @@
+"""
+Fleet TCP reachability (GFW) scanner.
+
+Opens plain TCP connections to thousands of (ip, port) targets at once on one
+asyncio event loop and measures the connect latency; nothing is sent. A fleet
+sweep probes SSH plus the security group ports of each instance's projects
+and stores the result per instance.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from logic import get_project_ports
+from db import update_instance_reachability
+
+# Connects in flight at the same time (each holds one socket / file descriptor)
+REACH_CONCURRENCY = 500
+# Seconds before a connect counts as blocked
+REACH_TIMEOUT = 3
+
+# instances row flag -> project key used by logic.SECURITY_GROUP_PORTS
+PROJECT_FLAGS = {
+    'proj_titan': 'Titan',
+    'proj_nexus': 'Nexus',
+    'proj_shardeum': 'Shardeum',
+    'proj_babylon': 'Babylon',
+    'proj_meson': 'Meson',
+    'proj_proxy': 'Proxy',
+}
+
+
+async def probe_port(ip, port, timeout=REACH_TIMEOUT):
+    """Returns: {open: bool, latency_ms: float | None, error: str | None}"""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except asyncio.TimeoutError:
+        return {"open": False, "latency_ms": None, "error": "timeout"}
+    except OSError as e:
+        return {"open": False, "latency_ms": None, "error": e.strerror or str(e)}
+    latency = (time.perf_counter() - start) * 1000
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return {"open": True, "latency_ms": round(latency, 1), "error": None}
+
+async def scan_async(targets, timeout=REACH_TIMEOUT, concurrency=REACH_CONCURRENCY):
+    """targets: iterable of (ip, port). Returns {(ip, port): probe_port result}."""
+    targets = list(dict.fromkeys((ip, int(port)) for ip, port in targets if ip))
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(target):
+        async with sem:
+            return target, await probe_port(target[0], target[1], timeout)
+
+    return dict(await asyncio.gather(*(one(t) for t in targets)))
+
+def scan(targets, timeout=REACH_TIMEOUT, concurrency=REACH_CONCURRENCY):
+    """Blocking scan_async for callers without a running event loop."""
+    return asyncio.run(scan_async(targets, timeout=timeout, concurrency=concurrency))
+
+def instance_ports(inst):
+    """SSH plus the ports of the projects flagged on an instances row."""
+    return get_project_ports([key for flag, key in PROJECT_FLAGS.items() if inst.get(flag)])
+
+def sweep_instances(instances, timeout=REACH_TIMEOUT, concurrency=REACH_CONCURRENCY, persist=True):
+    """
+    Probe every instance (rows from get_user_instances with an IP) on its
+    instance_ports() and store the summary on the row.
+    reachable is the SSH (22) result; ports maps port -> latency ms (None = blocked).
+    Returns: {instance_id: {reachable, latency_ms, ports, checked_at}}
+    """
+    plan = {i['instance_id']: (i['ip_address'], instance_ports(i)) for i in instances if i.get('ip_address')}
+    results = scan(((ip, p) for ip, ports in plan.values() for p in ports), timeout=timeout, concurrency=concurrency)
+
+    checked_at = datetime.now(timezone.utc).isoformat()
+    summary = {}
+    for instance_id, (ip, ports) in plan.items():
+        by_port = {str(p): results[(ip, p)]["latency_ms"] for p in ports}
+        summary[instance_id] = {
+            "reachable": results[(ip, 22)]["open"],
+            "latency_ms": results[(ip, 22)]["latency_ms"],
+            "ports": by_port,
+            "checked_at": checked_at
+        }
+    if persist and summary:
+        update_instance_reachability(summary)
+    return summary
@@ -0,0 +1,162 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from aws_pool import get_client
+from aws_cache import TTLCache, PersistentTTLCache
+
+# Price points older than this are dropped from the store
+SPOT_HISTORY_WINDOW = 24 * 3600
+# A (account, region, type) series is refreshed at most this often
+SPOT_REFRESH_INTERVAL = 15 * 60
+# An AZ that just returned InsufficientInstanceCapacity is skipped for a while
+CAPACITY_COOLDOWN = 30 * 60
+PRODUCT_DESCRIPTION = 'Linux/UNIX'
+# Placements a launch tries before giving up
+SPOT_MAX_PLACEMENTS = 3
+# Capacity errors that mean "try another placement"
+SPOT_CAPACITY_CODES = ('InsufficientInstanceCapacity', 'MaxSpotInstanceCountExceeded', 'SpotMaxPriceTooLow', 'Unsupported')
+
+# key "account|region|type" -> {"fetched": ts, "azs": {az: [[ts, price], ...]}}
+# AZ names are mapped per account, so the series is account scoped.
+_price_store = PersistentTTLCache('spot_prices', SPOT_HISTORY_WINDOW)
+# (account, region, az, type) -> True while in cooldown
+_exhausted = TTLCache(CAPACITY_COOLDOWN)
+
+
+def _account_key(ak):
+    return hashlib.sha256(ak.encode()).hexdigest()[:16]
+
+def _store_key(ak, region, instance_type):
+    return f"{_account_key(ak)}|{region}|{instance_type}"
+
+def _merge_points(points, new_points, now):
+    """Merge sorted [ts, price] series, dedupe timestamps, drop points outside the window."""
+    merged = dict((p[0], p[1]) for p in points)
+    merged.update((p[0], p[1]) for p in new_points)
+    series = sorted([ts, price] for ts, price in merged.items())
+    cutoff = now - SPOT_HISTORY_WINDOW
+    # Keep the last point before the cutoff: it is the price still in effect
+    start = 0
+    for n, p in enumerate(series):
+        if p[0] < cutoff:
+            start = n
+        else:
+            break
+    return series[start:]
+
+def refresh_spot_prices(ak, sk, region, instance_types, proxy_url=None, force=False, save=True):
+    """
+    Pull describe_spot_price_history for the types whose series is stale.
+    One paginated call per region covers every stale type; later calls only
+    ask for prices newer than the last fetch. Raises on AWS errors.
+    save=False leaves the disk write to the caller (_price_store.flush()).
+    Returns True if the store changed.
+    """
+    now = time.time()
+    stale = {}
+    for t in dict.fromkeys(instance_types):
+        entry = _price_store.get(_store_key(ak, region, t))
+        if force or not entry or now - entry['fetched'] > SPOT_REFRESH_INTERVAL:
+            stale[t] = entry
+    if not stale:
+        return False
+
+    if any(e is None for e in stale.values()):
+        start = now - SPOT_HISTORY_WINDOW
+    else:
+        start = min(e['fetched'] for e in stale.values())
+
+    ec2 = get_client(ak, sk, region, 'ec2', proxy_url=proxy_url)
+    paginator = ec2.get_paginator('describe_spot_price_history')
+    fetched = {t: {} for t in stale}
+    for page in paginator.paginate(
+        InstanceTypes=list(stale.keys()),
+        ProductDescriptions=[PRODUCT_DESCRIPTION],
+        StartTime=datetime.fromtimestamp(start, tz=timezone.utc),
+        PaginationConfig={'PageSize': 1000}
+    ):
+        for p in page.get('SpotPriceHistory', []):
+            t = p['InstanceType']
+            if t not in fetched:
+                continue
+            fetched[t].setdefault(p['AvailabilityZone'], []).append([int(p['Timestamp'].timestamp()), float(p['SpotPrice'])])
+
+    updates = {}
+    for t, azs in fetched.items():
+        old_azs = (stale[t] or {}).get('azs', {})
+        merged = {}
+        for az in set(old_azs) | set(azs):
+            merged[az] = _merge_points(old_azs.get(az, []), azs.get(az, []), now)
+        updates[_store_key(ak, region, t)] = {"fetched": now, "azs": merged}
+    _price_store.set_many(updates, save=save)
+    return True
+
+def get_price_history(ak, region, instance_type):
+    """Cached {az: [[ts, price], ...]} for one type (no API call)."""
+    entry = _price_store.get(_store_key(ak, region, instance_type))
+    return entry['azs'] if entry else {}
+
+def _summarize(series):
+    """Current price plus time-weighted average over the window."""
+    now = time.time()
+    current = series[-1][1]
+    total = 0.0
+    weighted = 0.0
+    for n, (ts, price) in enumerate(series):
+        begin = max(ts, now - SPOT_HISTORY_WINDOW)
+        end = series[n + 1][0] if n + 1 < len(series) else now
+        if end > begin:
+            weighted += price * (end - begin)
+            total += end - begin
+    avg = weighted / total if total else current
+    return current, avg, max(p[1] for p in series)
+
+def rank_placements(ak, sk, regions, instance_types, proxy_url=None, max_workers=10):
+    """
+    Rank (region, AZ, type) by current spot price, then by the 24h average.
+    AZs in capacity cooldown are left out. Prices come from the store; only
+    stale series are refreshed (at most once per SPOT_REFRESH_INTERVAL).
+    Returns: [{region, az, instance_type, price, avg_price, max_price}, ...]
+    """
+    regions = list(dict.fromkeys(regions))
+
+    def refresh(region):
+        try:
+            return refresh_spot_prices(ak, sk, region, instance_types, proxy_url=proxy_url, save=False)
+        except Exception as e:
+            # Rank on whatever is cached for this region
+            print(f"Spot price refresh failed ({region}): {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(regions)))) as executor:
+        changed = any(list(executor.map(refresh, regions)))
+    # One disk write per pass, and none when every series was fresh
+    if changed:
+        _price_store.flush()
+
+    candidates = []
+    for region in regions:
+        for t in instance_types:
+            for az, series in get_price_history(ak, region, t).items():
+                if not series or _exhausted.get((_account_key(ak), region, az, t)):
+                    continue
+                current, avg, peak = _summarize(series)
+                candidates.append({
+                    "region": region,
+                    "az": az,
+                    "instance_type": t,
+                    "price": current,
+                    "avg_price": round(avg, 6),
+                    "max_price": peak
+                })
+    candidates.sort(key=lambda c: (c['price'], c['avg_price']))
+    return candidates
+
+def mark_capacity_exhausted(ak, region, az, instance_type):
+    """Skip this placement in rankings until the cooldown expires."""
+    _exhausted.set((_account_key(ak), region, az, instance_type), True)
+
+def is_capacity_error(msg):
+    """launch_base_instances reports errors as text; detect spot capacity failures."""
+    return any(code in (msg or '') for code in SPOT_CAPACITY_CODES)
@@ -0,0 +1,38 @@
+-- Reusable SSH key pairs: one imported key per (credential, region)
+CREATE TABLE IF NOT EXISTS aws_key_pairs (
+    id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
+    user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE,
+    credential_id UUID REFERENCES aws_credentials(id) ON DELETE CASCADE,
+    region TEXT NOT NULL,
+    key_name TEXT NOT NULL,
+    private_key TEXT NOT NULL, -- Encrypted
+    fingerprint TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    UNIQUE (credential_id, region)
+);
+
+-- Instances reference the shared key instead of storing their own copy
+ALTER TABLE instances ADD COLUMN IF NOT EXISTS key_pair_id UUID REFERENCES aws_key_pairs(id) ON DELETE SET NULL;
+
+-- ==========================================
+-- RLS POLICIES
+-- ==========================================
+ALTER TABLE aws_key_pairs ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view own key pairs" ON aws_key_pairs;
+CREATE POLICY "Users can view own key pairs" ON aws_key_pairs
+    FOR SELECT
+    USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can insert own key pairs" ON aws_key_pairs;
+CREATE POLICY "Users can insert own key pairs" ON aws_key_pairs
+    FOR INSERT
+    WITH CHECK (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can delete own key pairs" ON aws_key_pairs;
+CREATE POLICY "Users can delete own key pairs" ON aws_key_pairs
+    FOR DELETE
+    USING (auth.uid() = user_id);
+
+-- Reload PostgREST schema cache so the new relationship is visible
+NOTIFY pgrst, 'reload config';
@@ -0,0 +1,8 @@
+-- Reachability (GFW) sweep results per instance, written by reachability.py
+ALTER TABLE instances ADD COLUMN IF NOT EXISTS reachable BOOLEAN;           -- SSH (22) reachable
+ALTER TABLE instances ADD COLUMN IF NOT EXISTS reach_latency_ms REAL;       -- SSH connect latency
+ALTER TABLE instances ADD COLUMN IF NOT EXISTS reach_ports JSONB;           -- {"port": latency_ms | null}
+ALTER TABLE instances ADD COLUMN IF NOT EXISTS reach_checked_at TIMESTAMPTZ;
+
+-- Reload PostgREST schema cache
+NOTIFY pgrst, 'reload schema';